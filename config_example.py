@@ -1,6 +1,7 @@
 """Example configuration file."""
 
 NAME = "example faucet"
+NODE_ID = "faucet-1"
 DATA_DIR = "/home/faucet/data"
 NETWORK = "regtest"
 ELECTRUM_URL = "tcp://electrs:50001"
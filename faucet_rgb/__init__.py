@@ -1,7 +1,9 @@
 """Faucet Flask app initialization and configuration."""
 
+import atexit
 import itertools
 import os
+import time
 import uuid
 
 from flask import Flask, g, request
@@ -10,9 +12,29 @@ from flask_migrate import upgrade
 from rgb_lib import Assets, Wallet
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from . import control, receive, reserve, tasks
-from .database import Request, db, migrate, select_query
+from . import control, exporter, receive, reserve, tasks
+from .cache import (
+    AssetCache,
+    PendingRequestsCache,
+    RequestStatsCache,
+    WalletRefresher,
+    WalletStateCache,
+    get_asset_metadata,
+    load_request_stats,
+    load_wallet_state,
+)
+from .database import (
+    Request,
+    db,
+    init_db,
+    load_asset_metadata,
+    migrate,
+    select_query,
+    store_asset_metadata,
+)
 from .exceptions import ConfigurationError
+from .groups import AssetGroups, compile_asset_groups
+from .metrics import Metrics
 from .scheduler import scheduler
 from .settings import check_config, configure_logging, get_app
 from .utils.wallet import get_sha256_hex, init_wallet, wallet_data_from_config
@@ -53,58 +75,81 @@ def _validate_migration_map(app: Flask):
     `ASSETS` section.
     """
     mig_map = app.config["ASSET_MIGRATION_MAP"]
+    asset_groups: AssetGroups = app.config["ASSET_GROUPS"]
     if mig_map is None:
-        app.config["NON_MIGRATION_GROUPS"] = set(app.config["ASSETS"])
+        app.config["NON_MIGRATION_GROUPS"] = set(asset_groups)
         return
     groups_to = set()
     for asset_id in mig_map:
-        containing_group = None
-        for group_name, group_data in app.config["ASSETS"].items():
-            for asset in group_data["assets"]:
-                if asset["asset_id"] == asset_id:
-                    containing_group = group_name
-        if containing_group is None:
+        containing_asset = asset_groups.get_asset(asset_id)
+        if containing_asset is None:
             raise ConfigurationError(
                 [f"error in ASSET_MIGRATION_MAP! asset {asset_id} is not " "defined in any group!"]
             )
 
-        groups_to.add(containing_group)
+        groups_to.add(containing_asset.group_name)
 
     # check all assets in migration groups are defined as migration destination
     dest_asset_ids = mig_map.keys()
     for group_to in groups_to:
-        for asset in app.config["ASSETS"][group_to]["assets"]:
-            asset_id = asset["asset_id"]
-            if asset_id not in dest_asset_ids:
+        for asset in asset_groups[group_to].assets:
+            if asset.asset_id not in dest_asset_ids:
                 raise ConfigurationError(
                     [
-                        f"asset ID {asset_id} is not defined as a migration "
+                        f"asset ID {asset.asset_id} is not defined as a migration "
                         "destination while other assets in the same group are!"
                     ]
                 )
-    app.config["NON_MIGRATION_GROUPS"] = set(app.config["ASSETS"]) - groups_to
+    app.config["NON_MIGRATION_GROUPS"] = set(asset_groups) - groups_to
 
 
-def _check_asset_availability(app: Flask):
-    """Ensure all the configured assets are available in the wallet."""
+def _check_asset_availability(app: Flask) -> Assets:
+    """Ensure all the configured assets are available in the wallet.
+
+    The wallet assets are returned.
+    """
     wallet: Wallet = app.config["WALLET"]
     assets = wallet.list_assets([])
     assets_nia = assets.nia or []
     assets_cfa = assets.cfa or []
-    asset_ids = [asset.asset_id for asset in assets_nia + assets_cfa]
-    for _, data in app.config["ASSETS"].items():
-        for asset in data["assets"]:
-            asset_id = asset["asset_id"]
-            if asset_id not in asset_ids:
-                _print_assets_and_quit(assets, asset_id)
+    asset_ids = {asset.asset_id for asset in assets_nia + assets_cfa}
+    for group in app.config["ASSET_GROUPS"].values():
+        for asset in group.assets:
+            if asset.asset_id not in asset_ids:
+                _print_assets_and_quit(assets, asset.asset_id)
+    return assets
+
 
+def _init_asset_cache(app: Flask, assets: Assets | None):
+    """Create and populate the asset metadata cache.
 
-def _get_group_and_asset_from_id(app: Flask, asset_id: str):
-    for group_name, group_data in app.config["ASSETS"].items():
-        for asset in group_data["assets"]:
-            if asset["asset_id"] == asset_id:
-                return (group_name, asset)
-    raise KeyError(asset_id)
+    Nodes with a wallet store the metadata of the provided wallet assets in
+    the database, web-only nodes (no assets provided) load it from there.
+    """
+
+    def _load_from_wallet():
+        wallet: Wallet = app.config["WALLET"]
+        metadata = get_asset_metadata(wallet.list_assets([]))
+        store_asset_metadata(metadata)
+        return metadata
+
+    with app.app_context():
+        if assets is None:
+            load = load_asset_metadata
+            metadata = load()
+            for group in app.config["ASSET_GROUPS"].values():
+                for asset in group.assets:
+                    if asset.asset_id not in metadata:
+                        app.logger.warning(
+                            "no metadata for asset %s yet, a worker needs to store it",
+                            asset.asset_id,
+                        )
+        else:
+            load = _load_from_wallet
+            metadata = get_asset_metadata(assets)
+            store_asset_metadata(metadata)
+    app.config["ASSET_CACHE"] = AssetCache(load)
+    app.config["ASSET_CACHE"].populate(metadata)
 
 
 def _get_all_requests_waiting_for_migration(rev_mig_map: dict[str, str]):
@@ -133,6 +178,9 @@ def _init_scheduler(app: Flask):
             seconds=app.config["SCHEDULER_INTERVAL"],
             id="batch_donation",
             replace_existing=True,
+            # runs brought forward by requests (see tasks.notify_request_queued)
+            # must not be dropped if the scheduler picks them up late
+            misfire_grace_time=None,
         )
         scheduler.add_job(
             func=tasks.random_distribution,
@@ -141,7 +189,25 @@ def _init_scheduler(app: Flask):
             id="random_distribution",
             replace_existing=True,
         )
+        scheduler.add_job(
+            func=tasks.leader_heartbeat,
+            trigger="interval",
+            seconds=app.config["LEADER_HEARTBEAT_INTERVAL"],
+            id="leader_heartbeat",
+            replace_existing=True,
+        )
+        if app.config["STATS_CACHE_MAX_AGE"] is not None:
+            scheduler.add_job(
+                func=tasks.refresh_request_stats,
+                trigger="interval",
+                seconds=app.config["STATS_CACHE_MAX_AGE"],
+                id="refresh_request_stats",
+                replace_existing=True,
+            )
         scheduler.start()
+        # release the scheduler lease on clean exits, for the last started app
+        atexit.unregister(tasks.release_scheduler_lease)
+        atexit.register(tasks.release_scheduler_lease, app)
 
 
 def _create_user_migration_cache(app: Flask):
@@ -153,6 +219,7 @@ def _create_user_migration_cache(app: Flask):
     if mig_map is None:
         return
 
+    asset_groups: AssetGroups = app.config["ASSET_GROUPS"]
     with app.app_context():
         rev_mig_map = {v: k for k, v in mig_map.items()}
 
@@ -163,7 +230,9 @@ def _create_user_migration_cache(app: Flask):
         for req in reqs_waiting_for_migration:
             new_asset_id = rev_mig_map.get(req.asset_id)
             if new_asset_id is not None:
-                group, asset = _get_group_and_asset_from_id(app, new_asset_id)
+                asset = asset_groups.get_asset(new_asset_id)
+                assert asset  # checked by _validate_migration_map
+                group = asset.group_name
                 if group not in mig_cache:
                     mig_cache[group] = {}
                 # only consider (old) requests with xPub wallet ID
@@ -193,6 +262,19 @@ def _create_user_migration_cache(app: Flask):
             )
 
 
+def _record_request_metrics(metrics: Metrics, status_code: int):
+    """Record the latency and DB queries of the current HTTP request."""
+    endpoint = request.endpoint or "none"
+    if "request_start" in g:
+        latency = time.perf_counter() - g.request_start
+        metrics.observe("faucet_http_request_duration_seconds", latency, endpoint=endpoint)
+    metrics.observe("faucet_http_request_db_queries", g.get("db_queries", 0), endpoint=endpoint)
+    metrics.observe(
+        "faucet_http_request_db_duration_seconds", g.get("db_duration", 0.0), endpoint=endpoint
+    )
+    metrics.inc("faucet_http_requests_total", endpoint=endpoint, status=status_code)
+
+
 def create_app(custom_get_app=None, do_init_wallet=True):
     """Create and configure the app.
 
@@ -210,20 +292,26 @@ def create_app(custom_get_app=None, do_init_wallet=True):
 
     # configuration checks
     check_config(app, log_dir)
+    app.config["ASSET_GROUPS"] = compile_asset_groups(app.config)
     _validate_migration_map(app)
 
-    # initialize the wallet
-    if do_init_wallet:
-        wallet_data = wallet_data_from_config(app.config)
-        app.config["ONLINE"], app.config["WALLET"] = init_wallet(
-            app.config["ELECTRUM_URL"], wallet_data
-        )
+    # initialize the wallet, unless serving HTTP requests only
+    assets = None
+    if app.config["ROLE"] == "web":
+        app.config["ONLINE"], app.config["WALLET"] = None, None
+    else:
+        if do_init_wallet:
+            wallet_data = wallet_data_from_config(app.config)
+            app.config["ONLINE"], app.config["WALLET"] = init_wallet(
+                app.config["ELECTRUM_URL"], wallet_data
+            )
 
-    # ensure all the configured assets are available
-    _check_asset_availability(app)
+        # ensure all the configured assets are available
+        assets = _check_asset_availability(app)
 
     # initialize DB
-    db.init_app(app)
+    app.config["METRICS"] = Metrics()
+    init_db(app)
     migrate.init_app(app, db)
     with app.app_context():
         upgrade()
@@ -231,23 +319,52 @@ def create_app(custom_get_app=None, do_init_wallet=True):
     # configure logging (needs to be after migration as alembic resets it)
     configure_logging(app)
 
+    _init_asset_cache(app, assets)
+    app.config["PENDING_REQUESTS"] = PendingRequestsCache()
+    app.config["REQUEST_STATS"] = RequestStatsCache(
+        lambda: load_request_stats(app.config["STATS_HISTOGRAM_HOURS"]),
+        app.config["STATS_CACHE_MAX_AGE"] or 0,
+    )
+    if app.config["WALLET"] is not None:
+        app.config["WALLET_STATE"] = WalletStateCache(
+            lambda: load_wallet_state(
+                app.config["WALLET"], app.config["ONLINE"], app.config["METRICS"]
+            ),
+            app.config["WALLET_STATE_MAX_AGE"],
+        )
+        app.config["WALLET_REFRESHER"] = WalletRefresher(
+            app.config["WALLET"],
+            app.config["ONLINE"],
+            app.config["WALLET_STATE"],
+            app.config["METRICS"],
+        )
+
     # pylint: disable=no-member
     @app.before_request
     def log_request():
         g.request_id = uuid.uuid4()
+        g.request_start = time.perf_counter()
         app.logger.info("> %s %s %s", g.get("request_id"), request.method, request.full_path)
 
     @app.after_request
     def log_response(response):
         app.logger.info("< %s %s", g.get("request_id"), response.status)
+        g.response_status = response.status_code
         return response
 
+    @app.teardown_request
+    def record_request(exc):
+        # runs once streamed responses are complete and after unhandled errors
+        status_code = 500 if exc is not None else g.get("response_status", 500)
+        _record_request_metrics(app.config["METRICS"], status_code)
+
     # pylint: enable=no-member
 
     _create_user_migration_cache(app)
 
     # register blueprints
     app.register_blueprint(control.bp)
+    app.register_blueprint(exporter.bp)
     app.register_blueprint(receive.bp)
     app.register_blueprint(reserve.bp)
 
@@ -255,8 +372,10 @@ def create_app(custom_get_app=None, do_init_wallet=True):
     if app.config["BEHIND_PROXY"]:
         app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
-    # initialize the scheduler, only if not already running
+    # initialize the scheduler, only if not already running and not serving
+    # HTTP requests only
     # this is necessary when re-starting the app from tests
-    _init_scheduler(app)
+    if app.config["ROLE"] != "web":
+        _init_scheduler(app)
 
     return app
@@ -0,0 +1,376 @@
+"""In-process caches module."""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from rgb_lib import Assets, Online, Wallet
+
+from .database import STATUS_MAP, db, served_per_hour_queries, status_counts_query
+from .metrics import Metrics
+from .utils import get_current_timestamp, get_logger
+
+
+def get_asset_metadata(assets: Assets) -> dict[str, dict]:
+    """Return the metadata of the provided assets, keyed by asset ID."""
+    metadata = {}
+    for schema in ("nia", "cfa"):
+        for asset in getattr(assets, schema) or []:
+            metadata[asset.asset_id] = {
+                "schema": schema.upper(),
+                "name": asset.name,
+                "precision": asset.precision,
+                "details": getattr(asset, "details", None),
+                "ticker": getattr(asset, "ticker", None),
+            }
+    return metadata
+
+
+class AssetCache:
+    """Cache of RGB asset metadata, keyed by asset ID.
+
+    Asset metadata (schema, name, precision, details, ticker) is immutable
+    after issuance, so it can be served from memory once loaded from the
+    wallet or, on nodes with no wallet, from the database. The cache is
+    populated on startup and repopulated, via the provided load function, on
+    misses and on explicit operator refresh.
+    """
+
+    def __init__(self, load: Callable[[], dict[str, dict]]):
+        self._load = load
+        self._lock = threading.Lock()
+        self._assets: dict[str, dict] = {}
+        self._hits = 0
+        self._misses = 0
+        self._populated_at: int | None = None
+
+    def populate(self, metadata: dict[str, dict]):
+        """Replace the cached metadata with the provided one."""
+        with self._lock:
+            self._assets = dict(metadata)
+            self._populated_at = get_current_timestamp()
+
+    def invalidate(self):
+        """Drop all cached metadata."""
+        with self._lock:
+            self._assets = {}
+            self._populated_at = None
+
+    def refresh(self):
+        """Repopulate the cache with freshly loaded metadata."""
+        self.populate(self._load())
+
+    def get(self, asset_id: str) -> dict | None:
+        """Return the cached metadata for the given asset ID, if any.
+
+        On a miss, the cache is refreshed before trying again.
+        """
+        with self._lock:
+            metadata = self._assets.get(asset_id)
+            if metadata is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        if metadata is None:
+            self.refresh()
+            with self._lock:
+                metadata = self._assets.get(asset_id)
+        return metadata
+
+    def stats(self):
+        """Return cache statistics."""
+        with self._lock:
+            return {
+                "size": len(self._assets),
+                "hits": self._hits,
+                "misses": self._misses,
+                "populated_at": self._populated_at,
+            }
+
+
+def load_wallet_state(wallet: Wallet, online: Online, metrics: Metrics) -> dict:
+    """Load the wallet state: NIA and CFA assets, with their balances, and unspents."""
+    asset_list = wallet.list_assets([])
+    with metrics.rgb_lib_call("list_unspents"):
+        unspents = wallet.list_unspents(online, False, False)
+    return {
+        "assets": (asset_list.nia or []) + (asset_list.cfa or []),
+        "unspents": unspents,
+    }
+
+
+class WalletStateCache:  # pylint: disable=too-many-instance-attributes
+    """Cache of the wallet state: assets, with their balances, and unspents.
+
+    Loading the wallet state goes to the indexer, so it is slow. The scheduler
+    reloads the state once per run and marks it stale whenever it changes the
+    wallet (UTXOs created, batch sent), so consumers (scheduler tasks, control
+    endpoints) are served from memory. State older than max_age seconds or
+    marked stale is reloaded on the next access, as is state requested with
+    force. Concurrent reloads are coalesced into a single one.
+    """
+
+    def __init__(self, load: Callable[[], dict], max_age: int):
+        self._load = load
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._state: dict | None = None
+        # monotonic time the cached state started loading at
+        self._loaded_at = 0.0
+        self._refreshed_at: int | None = None
+        self._stale = True
+        self._hits = 0
+        self._loads = 0
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._state is not None
+            and not self._stale
+            and time.monotonic() - self._loaded_at <= self._max_age
+        )
+
+    def mark_stale(self):
+        """Mark the cached state as stale, so it is reloaded on the next access."""
+        with self._lock:
+            self._stale = True
+
+    def refresh(self) -> dict:
+        """Reload the wallet state, return it."""
+        return self.get(force=True)
+
+    def get(self, force: bool = False) -> dict:
+        """Return the wallet state, reloading it if stale, too old or if forced."""
+        with self._lock:
+            if not force and self._is_fresh():
+                self._hits += 1
+                return self._state  # type: ignore[return-value]
+            requested_at = time.monotonic()
+        with self._load_lock:
+            with self._lock:
+                # a reload started after this call has completed while waiting
+                if self._state is not None and self._loaded_at >= requested_at:
+                    return self._state
+                self._stale = False
+            started_at = time.monotonic()
+            try:
+                state = self._load()
+            except Exception:
+                self.mark_stale()
+                raise
+            with self._lock:
+                self._state = state
+                self._loaded_at = started_at
+                self._refreshed_at = get_current_timestamp()
+                self._loads += 1
+                return state
+
+    def get_balance(self, asset_id: str, force: bool = False):
+        """Return the balance of the given asset, None if not in the wallet."""
+        for asset in self.get(force)["assets"]:
+            if asset.asset_id == asset_id:
+                return asset.balance
+        return None
+
+    def stats(self):
+        """Return cache statistics."""
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "loads": self._loads,
+                "max_age": self._max_age,
+                "refreshed_at": self._refreshed_at,
+                "stale": not self._is_fresh(),
+            }
+
+
+class WalletRefresher:  # pylint: disable=too-many-instance-attributes
+    """Background, coalesced wallet refresh.
+
+    Refreshing the wallet goes to the indexer and to the transport endpoints,
+    so it can take many seconds. Refreshes run in a background thread, one at
+    a time: requesting a refresh while one is queued or in flight attaches to
+    it instead of starting another one. Callers can wait for the refresh to
+    complete or go on with the last-known wallet state. Callers waiting need
+    a refresh started after their request, so if the one in flight had
+    already started, another one is queued after it. The wallet state cache
+    is marked stale after each refresh.
+    """
+
+    def __init__(
+        self, wallet: Wallet, online: Online, wallet_state: WalletStateCache, metrics: Metrics
+    ):
+        self._wallet = wallet
+        self._online = online
+        self._wallet_state = wallet_state
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wallet-refresh")
+        self._future: Future | None = None
+        self._refreshed_at: int | None = None
+
+    @property
+    def refreshed_at(self) -> int | None:
+        """Timestamp of the last completed refresh, None if there has been none."""
+        with self._lock:
+            return self._refreshed_at
+
+    def _refresh(self):
+        try:
+            with self._metrics.rgb_lib_call("refresh"):
+                self._wallet.refresh(self._online, None, [], False)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            get_logger(__name__).error("error refreshing transfers: %s", repr(err))
+            return
+        finally:
+            self._wallet_state.mark_stale()
+        with self._lock:
+            self._refreshed_at = get_current_timestamp()
+
+    def request(self, wait: bool = False) -> int | None:
+        """Request a refresh, unless one is queued or in flight, optionally waiting for it.
+
+        When waiting, a refresh in flight, which started before this call, is
+        not attached to: another refresh is queued after it.
+
+        Return the timestamp of the last completed refresh.
+        """
+        with self._lock:
+            if self._future is None or self._future.done() or (wait and self._future.running()):
+                self._future = self._executor.submit(self._refresh)
+            future = self._future
+        if wait:
+            future.result()
+        return self.refreshed_at
+
+    def request_if_older(self, max_age: int) -> int | None:
+        """Request a background refresh if the last one is older than max_age seconds.
+
+        Return the timestamp of the last completed refresh.
+        """
+        refreshed_at = self.refreshed_at
+        if refreshed_at is None or get_current_timestamp() - refreshed_at > max_age:
+            return self.request()
+        return refreshed_at
+
+
+class PendingRequestsCache:
+    """Cache of the number of pending requests, to bring batch donations forward.
+
+    The number of pending requests and the time the oldest one reaches the
+    maximum waiting time are read from the database on each batch donation
+    run. Requests queued since then by this process are counted in memory, so
+    notifying them goes to neither the database nor, unless the run is to be
+    brought forward, the scheduler. Requests queued by other processes are
+    only counted on the next run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._deadline: int | None = None
+        self._run_requested = False
+
+    def reset(self, count: int, deadline: int | None):
+        """Set the number of pending requests and the deadline of the oldest one."""
+        with self._lock:
+            self._count = count
+            self._deadline = deadline
+            self._run_requested = False
+
+    def add(self, count: int, max_wait: int, min_requests: int) -> int | None:
+        """Count newly queued requests, return when the next run is due, if not yet set.
+
+        The run is due now if there are at least min_requests pending
+        requests, else when the queued requests reach the max_wait seconds
+        waiting time, if no older pending request is already waiting.
+        """
+        now = get_current_timestamp()
+        with self._lock:
+            self._count += count
+            if self._count >= min_requests:
+                if self._run_requested:
+                    return None
+                self._run_requested = True
+                return now
+            if self._deadline is not None:
+                return None
+            self._deadline = now + max_wait
+            return self._deadline
+
+
+def load_request_stats(histogram_hours: int) -> dict:
+    """Compute request statistics.
+
+    Return request counts by asset group, asset ID and status, totals by
+    status and the number of requests served per hour in the last
+    histogram_hours hours.
+    """
+    counts = []
+    totals = {name: 0 for name in STATUS_MAP.values()}
+    for asset_group, asset_id, status, count in db.session.execute(status_counts_query()):
+        status_name = STATUS_MAP.get(status, str(status))
+        counts.append(
+            {
+                "asset_group": asset_group,
+                "asset_id": asset_id,
+                "status": status_name,
+                "count": count,
+            }
+        )
+        totals[status_name] = totals.get(status_name, 0) + count
+    now = get_current_timestamp()
+    since = now - histogram_hours * 3600
+    served_per_hour: dict[int, int] = {}
+    for query in served_per_hour_queries(since):
+        for hour, count in db.session.execute(query):
+            served_per_hour[hour] = served_per_hour.get(hour, 0) + count
+    return {
+        "counts": counts,
+        "totals": totals,
+        "served_per_hour": [
+            {"hour": hour, "count": count} for hour, count in sorted(served_per_hour.items())
+        ],
+        "computed_at": now,
+    }
+
+
+class RequestStatsCache:
+    """Cache of request statistics.
+
+    Statistics are computed with aggregate queries over the whole request
+    table, so dashboards polling them would load the database. With a
+    positive max_age, computed statistics are served for max_age seconds
+    (nodes running the scheduler also recompute them in the background),
+    otherwise they are computed on each access. Statistics are computed one
+    at a time and, when cached, callers waiting for a computation are served
+    its result.
+    """
+
+    def __init__(self, load: Callable[[], dict], max_age: int):
+        self._load = load
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._stats: dict | None = None
+        # monotonic time the cached statistics started being computed at
+        self._loaded_at = 0.0
+
+    def get(self, force: bool = False) -> dict:
+        """Return request statistics, recomputing them if too old or if forced."""
+        requested_at = time.monotonic()
+        with self._lock:
+            if (
+                not force
+                and self._stats is not None
+                and requested_at - self._loaded_at <= self._max_age
+            ):
+                return self._stats
+            started_at = time.monotonic()
+            self._stats = self._load()
+            self._loaded_at = started_at
+            return self._stats
+
+    def refresh(self) -> dict:
+        """Recompute request statistics, return them."""
+        return self.get(force=True)
@@ -1,106 +1,204 @@
 """Faucet blueprint to top-up funds."""
 
+import csv
+import io
+import json
+from typing import Sequence
+
 import rgb_lib
-from flask import Blueprint, current_app, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from rgb_lib import Online, Transfer, TransferStatus, Wallet
 
 from faucet_rgb import utils
-from faucet_rgb.utils.wallet import amount_from_assignment, get_unspent_list
+from faucet_rgb.cache import AssetCache, RequestStatsCache, WalletRefresher, WalletStateCache
+from faucet_rgb.metrics import Metrics
+from faucet_rgb.utils import operator_auth, wallet_required
+from faucet_rgb.utils.wallet import amount_from_assignment, format_unspents
 
-from .database import Request, db, select_query
+from .database import Batch, Lease, Request, db, select_query
+from .tasks import SCHEDULER_LEASE
 
 bp = Blueprint("control", __name__, url_prefix="/control")
 
+# max number of requests returned per page by /control/requests
+_REQUESTS_PAGE_SIZE = 100
+# number of requests fetched at a time when exporting requests
+_EXPORT_CHUNK_SIZE = 1000
+# request fields exported in CSV format, followed by the TXID of their batch
+_CSV_REQUEST_FIELDS = (
+    "idx",
+    "timestamp",
+    "status",
+    "wallet_id",
+    "recipient_id",
+    "invoice",
+    "asset_group",
+    "asset_id",
+    "amount",
+)
+
 
 # routes
 
 
 @bp.route("/assets", methods=["GET"])
+@operator_auth
+@wallet_required
 def assets():
-    """Return the list of RGB assets from rgb-lib."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
+    """Return the list of RGB assets from the last-known wallet state.
+
+    If the 'refresh' query parameter is set to 1, wait for a wallet refresh and
+    reload its state first, otherwise a background refresh is started if the
+    last one is older than WALLET_STATE_MAX_AGE.
+    """
+    state, refreshed_at = _get_wallet_state(request.args.get("refresh") == "1")
+    asset_dict = utils.get_asset_dict(state["assets"])
+    return jsonify({"assets": asset_dict, "refreshed_at": refreshed_at})
+
+
+@bp.route("/cache", methods=["GET"])
+@operator_auth
+def cache():
+    """Return asset metadata cache statistics."""
+    asset_cache: AssetCache = current_app.config["ASSET_CACHE"]
+    wallet_state: WalletStateCache | None = current_app.config["WALLET_STATE"]
+    return jsonify(
+        {
+            "assets": asset_cache.stats(),
+            "wallet_state": wallet_state.stats() if wallet_state else None,
+        }
+    )
 
-    online: Online = current_app.config["ONLINE"]
-    wallet: Wallet = current_app.config["WALLET"]
-    wallet.refresh(online, None, [], False)
-    asset_list = wallet.list_assets([])
-    assets_nia = asset_list.nia or []
-    assets_cfa = asset_list.cfa or []
-    asset_dict = utils.get_asset_dict(assets_nia + assets_cfa)
-    return jsonify({"assets": asset_dict})
+
+@bp.route("/cache/refresh", methods=["GET"])
+@operator_auth
+def cache_refresh():
+    """Invalidate the asset metadata cache and reload it.
+
+    Metadata is reloaded from the wallet or, on web-only nodes, from the database.
+    """
+    asset_cache: AssetCache = current_app.config["ASSET_CACHE"]
+    asset_cache.invalidate()
+    asset_cache.refresh()
+    return jsonify({"assets": asset_cache.stats()})
 
 
 @bp.route("/delete", methods=["GET"])
+@operator_auth
+@wallet_required
 def delete_transfers():
     """Delete currently failed transfers."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
-
     wallet: Wallet = current_app.config["WALLET"]
     res = wallet.delete_transfers(None, False)
     return jsonify({"result": res}), 200
 
 
 @bp.route("/fail", methods=["GET"])
+@operator_auth
+@wallet_required
 def fail_transfers():
     """Fail currently pending transfers."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
-
     online: Online = current_app.config["ONLINE"]
     wallet: Wallet = current_app.config["WALLET"]
     res = wallet.fail_transfers(online, None, False, False)
     return jsonify({"result": res}), 200
 
 
+@bp.route("/stats", methods=["GET"])
+@operator_auth
+def stats():
+    """Return request statistics.
+
+    Statistics include request counts by asset group, asset ID and status,
+    totals by status and the number of requests served per hour in the last
+    STATS_HISTOGRAM_HOURS hours. If STATS_CACHE_MAX_AGE is set, they are served
+    from a cache, unless the 'refresh' query parameter is set to 1.
+    """
+    request_stats: RequestStatsCache = current_app.config["REQUEST_STATS"]
+    return jsonify(request_stats.get(force=request.args.get("refresh") == "1"))
+
+
 @bp.route("/transfers", methods=["GET"])
+@operator_auth
+@wallet_required
 def list_transfers():
     """List asset transfers.
 
     Only transfers with an asset ID are queried, as the asset_id parameter to
-    the list_transfers rgb-lib API is mandatory.
+    the list_transfers rgb-lib API is mandatory. Asset IDs are taken from the
+    last-known wallet state, as for /control/assets.
 
     Pending transfers are listed by default. If a valid status is provided via
     query parameter, then transfers in that status are returned instead.
-    """
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
 
+    Transfers are listed as last refreshed. If the 'refresh' query parameter is
+    set to 1, wait for a wallet refresh and reload its state first, otherwise a
+    background refresh is started if the last one is older than
+    WALLET_STATE_MAX_AGE.
+    """
     status_filter, error = _get_status_filter(request.args.get("status"))
     if error:
         return jsonify({"error": error}), 403
     assert status_filter
 
-    online: Online = current_app.config["ONLINE"]
     wallet: Wallet = current_app.config["WALLET"]
-    wallet.refresh(online, None, [], False)
-    asset_ids = _get_asset_ids(wallet)
+    state, refreshed_at = _get_wallet_state(request.args.get("refresh") == "1")
     transfers = []
-    for asset_id in asset_ids:
-        asset_transfers = wallet.list_transfers(asset_id)
+    for asset in state["assets"]:
+        asset_transfers = wallet.list_transfers(asset.asset_id)
         for transfer in asset_transfers:
             if transfer.status not in status_filter:
                 continue
             transfers.append(_format_transfer(transfer))
-    return jsonify({"transfers": transfers})
+    return jsonify({"transfers": transfers, "refreshed_at": refreshed_at})
+
+
+@bp.route("/leader", methods=["GET"])
+@operator_auth
+def leader():
+    """Return the scheduler leader lease and whether this process holds it."""
+    node_id = current_app.config["NODE_ID"]
+    holder_id = current_app.config["LEASE_HOLDER_ID"]
+    lease = db.session.get(Lease, SCHEDULER_LEASE)
+    lease_dict = None
+    is_leader = False
+    if lease is not None:
+        lease_dict = {
+            "holder": lease.holder,
+            "acquired_at": lease.acquired_at,
+            "renewed_at": lease.renewed_at,
+            "expires_at": lease.expires_at,
+            "expired": lease.expires_at < utils.get_current_timestamp(),
+        }
+        is_leader = lease.holder == holder_id and not lease_dict["expired"]
+    return jsonify(
+        {"node_id": node_id, "holder_id": holder_id, "leader": is_leader, "lease": lease_dict}
+    )
+
+
+@bp.route("/pipeline", methods=["GET"])
+@operator_auth
+def pipeline():
+    """Return sending pipeline metrics.
+
+    Metrics include the time spent in each stage and the UTXO pool sizing, as
+    recorded in the /metrics stage histogram and gauges.
+    """
+    metrics: Metrics = current_app.config["METRICS"]
+    return jsonify(metrics.pipeline_stats())
 
 
 @bp.route("/refresh/<asset_id>", methods=["GET"])
+@operator_auth
+@wallet_required
 def refresh(asset_id: str):
     """Refresh asset transfers."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
-
     online: Online = current_app.config["ONLINE"]
     wallet: Wallet = current_app.config["WALLET"]
+    metrics: Metrics = current_app.config["METRICS"]
     try:
-        res = wallet.refresh(online, asset_id, [], False)
+        with metrics.rgb_lib_call("refresh"):
+            res = wallet.refresh(online, asset_id, [], False)
         result = {}
         for k, v in res.items():
             updated_status = None if not v.updated_status else v.updated_status.name
@@ -116,78 +214,184 @@ def refresh(asset_id: str):
 
 
 @bp.route("/requests", methods=["GET"])
+@operator_auth
 def list_requests():
-    """Return requests.
+    """Return requests, most recent first.
 
-    Max 100 requests are returned.
     Request can include filters as query parameters:
     - 'status'
     - 'asset_group'
     - 'asset_id'
     - 'recipient_id'
     - 'wallet_id'
+    - 'txid'
+    - 'from_timestamp' and 'to_timestamp' (inclusive)
 
-    If no filter is provided, all requests in status 20 are returned
-    """
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
-
-    asset_group = request.args.get("asset_group")
-    asset_id = request.args.get("asset_id")
-    recipient_id = request.args.get("recipient_id")
-    status = request.args.get("status")
-    wallet_id = request.args.get("wallet_id")
-    if all(a is None for a in [asset_group, asset_id, recipient_id, status, wallet_id]):
-        status = 20
-
-    stmt = select_query()
-    if asset_group:
-        stmt = stmt.where(Request.asset_group == asset_group)
-    if asset_id:
-        stmt = stmt.where(Request.asset_id == asset_id)
-    if recipient_id:
-        stmt = stmt.where(Request.recipient_id == recipient_id)
-    if status:
-        stmt = stmt.where(Request.status == status)
-    if wallet_id:
-        stmt = stmt.where(Request.wallet_id == wallet_id)
-
-    requests = []
-    for req in db.session.scalars(stmt.order_by(Request.idx.desc()).limit(100)):
-        requests.append(
-            {
-                "idx": req.idx,
-                "timestamp": req.timestamp,
-                "status": req.status,
-                "wallet_id": req.wallet_id,
-                "recipient_id": req.recipient_id,
-                "invoice": req.invoice,
-                "asset_group": req.asset_group,
-                "asset_id": req.asset_id,
-                "amount": req.amount,
-            }
-        )
+    If no filter is provided, all requests in status 20 are returned.
 
-    return jsonify({"requests": requests})
+    Max 100 requests are returned per page, along with the 'next_after_idx'
+    to be passed as 'after_idx' query parameter to get the next page (None on
+    the last page). If the 'format' query parameter is set to 'ndjson' or
+    'csv', all matching requests are instead streamed in the given format,
+    in chunks, so large exports use constant memory.
+
+    Each request includes the record of the batch that served it, if any.
+    """
+    resp_format = request.args.get("format", "json")
+    if resp_format not in ("json", "ndjson", "csv"):
+        return jsonify({"error": f"unsupported format: {resp_format}"}), 400
+    try:
+        stmt = _get_requests_query(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    if resp_format == "ndjson":
+        rows = (json.dumps(req) + "\n" for req in _stream_requests(stmt))
+        return Response(stream_with_context(rows), mimetype="application/x-ndjson")
+    if resp_format == "csv":
+        return Response(stream_with_context(_stream_requests_csv(stmt)), mimetype="text/csv")
+
+    reqs = db.session.scalars(stmt.limit(_REQUESTS_PAGE_SIZE)).all()
+    batches = _get_batches(reqs)
+    next_after_idx = reqs[-1].idx if len(reqs) == _REQUESTS_PAGE_SIZE else None
+    return jsonify(
+        {
+            "requests": [_format_request(req, batches.get(req.batch_idx)) for req in reqs],
+            "next_after_idx": next_after_idx,
+        }
+    )
 
 
 @bp.route("/unspents", methods=["GET"])
+@operator_auth
+@wallet_required
 def unspents():
-    """Return the list of wallet unspents."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
+    """Return the list of wallet unspents, from the last-known wallet state.
 
-    online: Online = current_app.config["ONLINE"]
-    wallet: Wallet = current_app.config["WALLET"]
-    unspent_list = get_unspent_list(wallet, online)
-    return jsonify({"unspents": unspent_list})
+    If the 'refresh' query parameter is set to 1, wait for a wallet refresh and
+    reload its state first, otherwise a background refresh is started if the
+    last one is older than WALLET_STATE_MAX_AGE.
+    """
+    state, refreshed_at = _get_wallet_state(request.args.get("refresh") == "1")
+    unspent_list = format_unspents(state["unspents"])
+    return jsonify({"unspents": unspent_list, "refreshed_at": refreshed_at})
 
 
 # helpers
 
 
+def _refresh_wallet(wait: bool):
+    """Request a wallet refresh, return the timestamp of the last completed one.
+
+    If wait is True, wait for the refresh to complete, otherwise only start a
+    background refresh if the last one is older than WALLET_STATE_MAX_AGE.
+    """
+    refresher: WalletRefresher = current_app.config["WALLET_REFRESHER"]
+    if wait:
+        return refresher.request(wait=True)
+    return refresher.request_if_older(current_app.config["WALLET_STATE_MAX_AGE"])
+
+
+def _get_wallet_state(wait: bool):
+    """Return the wallet state and the timestamp of the last wallet refresh.
+
+    If wait is True, wait for a wallet refresh and reload the state first.
+    """
+    wallet_state: WalletStateCache = current_app.config["WALLET_STATE"]
+    refreshed_at = _refresh_wallet(wait)
+    return wallet_state.get(force=wait), refreshed_at
+
+
+def _get_requests_query(args):
+    """Return the query for the requests matching the provided query parameters.
+
+    Raise ValueError if a numeric parameter is not an integer.
+    """
+    int_args = {}
+    for arg in ("after_idx", "from_timestamp", "to_timestamp"):
+        try:
+            int_args[arg] = int(args[arg]) if args.get(arg) else None
+        except ValueError as err:
+            raise ValueError(f"invalid {arg}, it must be an integer") from err
+
+    filters = {
+        column: args.get(column)
+        for column in ("asset_group", "asset_id", "recipient_id", "status", "wallet_id")
+    }
+    txid = args.get("txid")
+    from_ts, to_ts = int_args["from_timestamp"], int_args["to_timestamp"]
+    if all(v is None for v in [*filters.values(), txid, from_ts, to_ts]):
+        filters["status"] = 20
+
+    stmt = select_query(
+        *(getattr(Request, column) == value for column, value in filters.items() if value)
+    )
+    if txid:
+        stmt = stmt.join(Batch, Request.batch_idx == Batch.idx).where(Batch.txid == txid)
+    if from_ts is not None:
+        stmt = stmt.where(Request.timestamp >= from_ts)
+    if to_ts is not None:
+        stmt = stmt.where(Request.timestamp <= to_ts)
+    if int_args["after_idx"] is not None:
+        stmt = stmt.where(Request.idx < int_args["after_idx"])
+    return stmt.order_by(Request.idx.desc())
+
+
+def _stream_requests(stmt):
+    """Yield the formatted requests returned by the given query, in chunks."""
+    result = db.session.scalars(stmt.execution_options(yield_per=_EXPORT_CHUNK_SIZE))
+    for reqs in result.partitions():
+        batches = _get_batches(reqs)
+        for req in reqs:
+            yield _format_request(req, batches.get(req.batch_idx))
+
+
+def _stream_requests_csv(stmt):
+    """Yield the requests returned by the given query as CSV lines, with a header."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def _flush():
+        line = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return line
+
+    writer.writerow([*_CSV_REQUEST_FIELDS, "txid"])
+    yield _flush()
+    for req in _stream_requests(stmt):
+        batch = req["batch"] or {}
+        writer.writerow([*(req[field] for field in _CSV_REQUEST_FIELDS), batch.get("txid")])
+        yield _flush()
+
+
+def _format_request(req: Request, batch: dict | None):
+    """Format a request object for the API response."""
+    return {
+        "idx": req.idx,
+        "timestamp": req.timestamp,
+        "status": req.status,
+        "wallet_id": req.wallet_id,
+        "recipient_id": req.recipient_id,
+        "invoice": req.invoice,
+        "asset_group": req.asset_group,
+        "asset_id": req.asset_id,
+        "amount": req.amount,
+        "batch": batch,
+    }
+
+
+def _get_batches(reqs: Sequence[Request]) -> dict[int, dict]:
+    """Return the batches that served the given requests, keyed by batch idx."""
+    batch_idxs = {req.batch_idx for req in reqs if req.batch_idx is not None}
+    if not batch_idxs:
+        return {}
+    return {
+        batch.idx: batch.to_dict()
+        for batch in db.session.scalars(db.select(Batch).where(Batch.idx.in_(batch_idxs)))
+    }
+
+
 def _get_status_filter(status: None | str):
     """
     Return the status filter list based on the query parameter,
@@ -204,14 +408,6 @@ def _get_status_filter(status: None | str):
     return [requested_status], None
 
 
-def _get_asset_ids(wallet: Wallet):
-    """Return a list of NIA and CFA asset IDs from the wallet."""
-    asset_list = wallet.list_assets([])
-    assets_nia = asset_list.nia or []
-    assets_cfa = asset_list.cfa or []
-    return [a.asset_id for a in assets_nia + assets_cfa]
-
-
 def _format_transfer(transfer: Transfer):
     """Format a transfer object for the API response."""
     ttes = [
@@ -1,12 +1,19 @@
 """Default application settings."""
 
+import time
+from typing import Sequence
+
+from flask import Flask, g, has_request_context
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Integer, String, func
+from sqlalchemy import JSON, Float, ForeignKey, Integer, String, Text, case, event, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql.functions import Function
 from sqlalchemy.orm import Mapped, mapped_column
 
-from .utils import get_current_timestamp
+from .metrics import Metrics
+from .utils import ParsedInvoice, get_current_timestamp
 
 db = SQLAlchemy()  # pylint: disable=invalid-name
 migrate = Migrate()
@@ -22,9 +29,122 @@ STATUS_MAP = {
     45: "unmet",
 }
 
+BATCH_STATUS_MAP = {
+    5: "preparing",
+    10: "prepared",
+    20: "signed",
+    30: "broadcast",
+    45: "failed",
+}
+
+# dialect-specific INSERT constructs, supporting ON CONFLICT DO NOTHING
+_INSERT_FUNCS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class Batch(db.Model):  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Batch model.
+
+    A batch is a set of requests sent with a single transaction. Sending goes
+    through phases, each one persisted along with the PSBT, so that an
+    interrupted send can be resumed from the last completed phase:
+    - preparing (5): the batch and its requests have been persisted, the
+      transaction is being built (an interrupted one is failed instead)
+    - prepared (10): the unsigned PSBT has been built
+    - signed (20): the PSBT has been signed
+    - broadcast (30): the transaction has been broadcast
+    - failed (45): sending has failed and is not going to be resumed
+
+    Once broadcast, the batch records the TXID that served its requests.
+    Duration is the time, in seconds, spent building, signing and
+    broadcasting the transaction.
+
+    The TXID is indexed, for lookups of the requests served by a transaction,
+    and the broadcast time is, for per-hour statistics of served requests.
+    """
+
+    __table_args__ = (
+        db.Index("ix_batch_txid", "txid"),
+        db.Index("ix_batch_broadcast_at", "broadcast_at"),
+    )
+
+    idx: Mapped[int] = mapped_column(Integer, primary_key=True)
+    status: Mapped[int] = mapped_column(Integer, nullable=False)
+    node_id: Mapped[str] = mapped_column(String(256), nullable=False)
+    psbt: Mapped[str] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[int] = mapped_column(Integer, nullable=False)
+    updated_at: Mapped[int] = mapped_column(Integer, nullable=False)
+    txid: Mapped[str] = mapped_column(String(64), nullable=True)
+    broadcast_at: Mapped[int] = mapped_column(Integer, nullable=True)
+    fee_rate: Mapped[int] = mapped_column(Integer, nullable=False)
+    recipients: Mapped[int] = mapped_column(Integer, nullable=False)
+    witnesses: Mapped[int] = mapped_column(Integer, nullable=False)
+    duration: Mapped[float] = mapped_column(Float, nullable=False)
+
+    def __init__(self, node_id: str, fee_rate: int, stats: dict):
+        now = get_current_timestamp()
+        self.status = 5
+        self.node_id = node_id
+        self.attempts = 0
+        self.created_at = now
+        self.updated_at = now
+        self.fee_rate = fee_rate
+        self.recipients = stats["recipients"]
+        self.witnesses = stats["witnesses"]
+        self.duration = 0.0
+
+    def set_status(self, status: int, psbt: str | None = None):
+        """Move the batch to the given status, optionally updating its PSBT."""
+        self.status = status
+        if psbt is not None:
+            self.psbt = psbt
+        self.updated_at = get_current_timestamp()
+
+    def set_broadcast(self, txid: str):
+        """Move the batch to status "broadcast", recording the given TXID."""
+        self.set_status(30)
+        self.txid = txid
+        self.broadcast_at = self.updated_at
+
+    def to_dict(self):
+        """Return the batch record as a dict, PSBT excluded."""
+        return {
+            "idx": self.idx,
+            "status": self.status,
+            "txid": self.txid,
+            "created_at": self.created_at,
+            "broadcast_at": self.broadcast_at,
+            "fee_rate": self.fee_rate,
+            "recipients": self.recipients,
+            "witnesses": self.witnesses,
+            "duration": self.duration,
+            "attempts": self.attempts,
+        }
+
 
 class Request(db.Model):  # pylint: disable=too-few-public-methods,too-many-instance-attributes
-    """Request model."""
+    """Request model.
+
+    Indexes cover the hot queries:
+    - (wallet_id, asset_group): per-wallet eligibility checks on /receive,
+      unique so a wallet can never place two requests for the same group
+    - (status, asset_id, timestamp, idx): scheduler queue scans, per asset
+    - (status, timestamp): oldest request lookups and stale request cleanup
+    - (timestamp): time range filters on /control/requests
+    - (batch_idx): requests of a batch
+
+    The recipient type, transport endpoints and expiration are parsed from the
+    invoice on admission, so requests can be sent without parsing it again.
+    They are not set for requests admitted before they were introduced.
+    """
+
+    __table_args__ = (
+        db.Index("ix_request_wallet_id_asset_group", "wallet_id", "asset_group", unique=True),
+        db.Index("ix_request_status_asset_id_timestamp", "status", "asset_id", "timestamp", "idx"),
+        db.Index("ix_request_status_timestamp", "status", "timestamp"),
+        db.Index("ix_request_timestamp", "timestamp"),
+        db.Index("ix_request_batch_idx", "batch_idx"),
+    )
 
     idx: Mapped[int] = mapped_column(Integer, primary_key=True)
     timestamp: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -35,6 +155,13 @@ class Request(db.Model):  # pylint: disable=too-few-public-methods,too-many-inst
     asset_group: Mapped[str] = mapped_column(String(256), nullable=False)
     asset_id: Mapped[str] = mapped_column(String(256), nullable=True)
     amount: Mapped[int] = mapped_column(Integer, nullable=True)
+    claimed_by: Mapped[str] = mapped_column(String(256), nullable=True)
+    batch_idx: Mapped[int] = mapped_column(
+        ForeignKey("batch.idx", name="fk_request_batch_idx_batch"), nullable=True
+    )
+    recipient_type: Mapped[str] = mapped_column(String(16), nullable=True)
+    transport_endpoints: Mapped[list] = mapped_column(JSON, nullable=True)
+    expiration: Mapped[int] = mapped_column(Integer, nullable=True)
 
     # pylint: disable=too-many-positional-arguments
     def __init__(
@@ -45,16 +172,22 @@ class Request(db.Model):  # pylint: disable=too-few-public-methods,too-many-inst
         asset_group: str,
         asset_id: str,
         amount: int,
+        status: int = 10,
+        parsed_invoice: ParsedInvoice | None = None,
     ):
         # pylint: disable=too-many-arguments
         self.timestamp = get_current_timestamp()
-        self.status = 10
+        self.status = status
         self.wallet_id = wallet_id
         self.recipient_id = recipient_id
         self.invoice = invoice
         self.asset_group = asset_group
         self.asset_id = asset_id
         self.amount = amount
+        if parsed_invoice is not None:
+            self.recipient_type = parsed_invoice.recipient_type
+            self.transport_endpoints = list(parsed_invoice.transport_endpoints)
+            self.expiration = parsed_invoice.expiration
 
     def __str__(self):
         return (
@@ -64,6 +197,239 @@ class Request(db.Model):  # pylint: disable=too-few-public-methods,too-many-inst
         )
 
 
+class AssetMetadata(db.Model):  # pylint: disable=too-few-public-methods
+    """Asset metadata model.
+
+    Nodes with a wallet store the metadata of the wallet assets, so that
+    web-only nodes (see the ROLE configuration variable) can serve requests
+    without a wallet.
+    """
+
+    asset_id: Mapped[str] = mapped_column(String(256), primary_key=True)
+    schema: Mapped[str] = mapped_column(String(16), nullable=False)
+    name: Mapped[str] = mapped_column(String(256), nullable=False)
+    precision: Mapped[int] = mapped_column(Integer, nullable=False)
+    details: Mapped[str] = mapped_column(Text, nullable=True)
+    ticker: Mapped[str] = mapped_column(String(256), nullable=True)
+
+
+class Lease(db.Model):  # pylint: disable=too-few-public-methods
+    """Lease model.
+
+    A lease is held by a single node at a time, until it expires. The holder
+    renews it periodically (heartbeat) and any node can take it over once it
+    has expired.
+    """
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(256), nullable=False)
+    acquired_at: Mapped[int] = mapped_column(Integer, nullable=False)
+    renewed_at: Mapped[int] = mapped_column(Integer, nullable=False)
+    expires_at: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    def __init__(self, name: str, holder: str, ttl: int):
+        now = get_current_timestamp()
+        self.name = name
+        self.holder = holder
+        self.acquired_at = now
+        self.renewed_at = now
+        self.expires_at = now + ttl
+
+
+def init_db(app: Flask):
+    """Initialize the database engine for the app.
+
+    The connection pool is sized from the app configuration and, for SQLite,
+    the configured pragmas are applied to each new connection. Query
+    durations are recorded in the app metrics, also per HTTP request.
+    """
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": app.config["DATABASE_POOL_SIZE"],
+        "max_overflow": app.config["DATABASE_POOL_MAX_OVERFLOW"],
+        "pool_timeout": app.config["DATABASE_POOL_TIMEOUT"],
+    }
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            pragmas = app.config["DATABASE_SQLITE_PRAGMAS"]
+            event.listen(db.engine, "connect", _get_sqlite_pragmas_setter(pragmas))
+        if app.config["METRICS"] is not None:
+            _listen_query_metrics(app.config["METRICS"])
+
+
+def _get_sqlite_pragmas_setter(pragmas: dict):
+    """Return a connect event listener setting the provided SQLite pragmas."""
+
+    def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return _set_sqlite_pragmas
+
+
+def _listen_query_metrics(metrics: Metrics):
+    """Record the duration of each query run on the app engine in the provided metrics.
+
+    Queries run while serving an HTTP request are also counted, along with
+    their duration, in the request globals (db_queries and db_duration).
+    """
+
+    def _before_cursor_execute(conn, *_):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(conn, *_):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        metrics.observe("faucet_db_query_duration_seconds", elapsed)
+        if has_request_context():
+            g.db_queries = g.get("db_queries", 0) + 1
+            g.db_duration = g.get("db_duration", 0.0) + elapsed
+
+    def _handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+    event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(db.engine, "handle_error", _handle_error)
+
+
+def claim_requests(stmt, node_id: str) -> list[Request]:
+    """Claim the pending requests selected by the provided statement.
+
+    Selected rows are locked with FOR UPDATE SKIP LOCKED, where the database
+    supports it, and only the ones that are still pending are moved to
+    "processing" on behalf of the given node, so concurrent nodes always
+    claim disjoint sets of requests. The transaction is committed.
+    """
+    idxs = db.session.scalars(
+        stmt.with_only_columns(Request.idx).with_for_update(skip_locked=True)
+    ).all()
+    if not idxs:
+        db.session.commit()
+        return []
+    claimed = db.session.scalars(
+        update_query(Request.idx.in_(idxs), Request.status == 20)
+        .values(status=30, claimed_by=node_id)
+        .returning(Request.idx)
+    ).all()
+    db.session.commit()
+    return list(
+        db.session.scalars(
+            select_query(Request.idx.in_(claimed)).order_by(Request.timestamp, Request.idx)
+        )
+    )
+
+
+def insert_requests(reqs: Sequence[Request]) -> set[tuple[str, str]]:
+    """Insert the given requests with a single statement, skipping double ones.
+
+    Requests for a (wallet ID, asset group) pair that has already been
+    requested, e.g. by a concurrent request, are skipped by the database (ON
+    CONFLICT DO NOTHING on the unique index), so they never make the whole
+    insert fail. The transaction is committed. Return the (wallet ID, asset
+    group) pairs of the inserted requests.
+    """
+    if not reqs:
+        return set()
+    table = Request.__table__
+    insert = _INSERT_FUNCS[db.session.get_bind().dialect.name]
+    stmt = (
+        insert(table)
+        .on_conflict_do_nothing(index_elements=["wallet_id", "asset_group"])
+        .returning(table.c.wallet_id, table.c.asset_group)
+    )
+    columns = [col.key for col in table.columns if col.key != "idx"]
+    rows = [{col: getattr(req, col) for col in columns} for req in reqs]
+    inserted = {tuple(row) for row in db.session.execute(stmt, rows)}
+    db.session.commit()
+    return inserted
+
+
+def serve_batch(batch_idx: int) -> int:
+    """Mark the requests of the given broadcast batch as served.
+
+    The batch is committed as broadcast, with its TXID, before its requests are
+    served, so it is never broadcast again: requests left in "processing" if
+    this fails are served when resuming batches. Requests are moved to
+    "served" with a single bulk UPDATE, so the time it takes does not grow
+    with the batch size. Return the number of served requests.
+    """
+    served = db.session.execute(
+        update_query(Request.batch_idx == batch_idx, Request.status == 30).values(status=40)
+    ).rowcount  # type: ignore[attr-defined]
+    db.session.commit()
+    return served
+
+
+def acquire_lease(name: str, node_id: str, ttl: int) -> bool:
+    """Acquire or renew the named lease for the given node, for ttl seconds.
+
+    The lease is taken with a single conditional UPDATE, so only one node can
+    succeed: the current holder renews it, other nodes can only take it over
+    once it has expired. Return if the node holds the lease.
+    """
+    now = get_current_timestamp()
+    renewed = db.session.execute(
+        db.update(Lease)
+        .where(Lease.name == name, or_(Lease.holder == node_id, Lease.expires_at < now))
+        .values(
+            holder=node_id,
+            acquired_at=case((Lease.holder == node_id, Lease.acquired_at), else_=now),
+            renewed_at=now,
+            expires_at=now + ttl,
+        )
+    ).rowcount  # type: ignore[attr-defined]
+    if renewed:
+        db.session.commit()
+        return True
+    if db.session.get(Lease, name) is not None:
+        db.session.rollback()
+        return False
+    # first acquisition, another node might be trying at the same time
+    try:
+        db.session.add(Lease(name, node_id, ttl))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def release_lease(name: str, node_id: str):
+    """Release the named lease, if held by the given node, so any node can take it over."""
+    db.session.execute(
+        db.update(Lease)
+        .where(Lease.name == name, Lease.holder == node_id)
+        .values(expires_at=get_current_timestamp() - 1)
+    )
+    db.session.commit()
+
+
+def load_asset_metadata() -> dict[str, dict]:
+    """Return the stored asset metadata, keyed by asset ID."""
+    return {
+        asset.asset_id: {
+            "schema": asset.schema,
+            "name": asset.name,
+            "precision": asset.precision,
+            "details": asset.details,
+            "ticker": asset.ticker,
+        }
+        for asset in db.session.scalars(db.select(AssetMetadata))
+    }
+
+
+def store_asset_metadata(metadata: dict[str, dict]):
+    """Replace the stored asset metadata with the provided one."""
+    db.session.execute(db.delete(AssetMetadata))
+    db.session.add_all(
+        AssetMetadata(asset_id=asset_id, **asset) for asset_id, asset in metadata.items()
+    )
+    db.session.commit()
+
+
 def count_query(*conditions):
     """Count Request rows based on provided conditions."""
     return db.select(COUNT_FUNC).select_from(Request).where(*conditions)
@@ -74,6 +440,68 @@ def delete_query(*conditions):
     return db.delete(Request).where(*conditions)
 
 
+def status_counts_query():
+    """Count Request rows by asset group, asset ID and status."""
+    return db.select(Request.asset_group, Request.asset_id, Request.status, COUNT_FUNC).group_by(
+        Request.asset_group, Request.asset_id, Request.status
+    )
+
+
+def status_totals_query():
+    """Count Request rows by status."""
+    return db.select(Request.status, COUNT_FUNC).group_by(Request.status)
+
+
+def served_per_hour_queries(since: int):
+    """Count Request rows served since the given timestamp, by hour.
+
+    Requests are counted in the hour their batch has been broadcast or, for
+    requests served before batches were recorded, they have been received.
+    Return two queries, one for each case, so that each one filters on an
+    indexed column (batch broadcast time and request status and timestamp).
+    """
+    since -= since % 3600
+    batch_hour = (Batch.broadcast_at // 3600 * 3600).label("hour")
+    request_hour = (Request.timestamp // 3600 * 3600).label("hour")
+    return (
+        db.select(batch_hour, COUNT_FUNC)
+        .select_from(Batch)
+        .join(Request, Request.batch_idx == Batch.idx)
+        .where(Batch.broadcast_at >= since, Request.status == 40)
+        .group_by(batch_hour),
+        db.select(request_hour, COUNT_FUNC)
+        .where(Request.status == 40, Request.timestamp >= since, Request.batch_idx.is_(None))
+        .group_by(request_hour),
+    )
+
+
+def pending_query(*conditions):
+    """Select pending Request rows, oldest first, based on provided conditions.
+
+    Requests are sorted by timestamp, then by ID for the ones received in the
+    same second, wherever the oldest pending requests are looked up.
+    """
+    return select_query(Request.status == 20, *conditions).order_by(Request.timestamp, Request.idx)
+
+
+def requested_groups_query(wallet_id: str):
+    """Select the asset groups the given wallet ID has placed requests for."""
+    return (
+        db.select(Request.asset_group)
+        .where(Request.wallet_id == wallet_id)
+        .group_by(Request.asset_group)
+    )
+
+
+def requested_pairs_query(wallet_ids: list[str]):
+    """Select the (wallet ID, asset group) pairs requested by the given wallet IDs."""
+    return (
+        db.select(Request.wallet_id, Request.asset_group)
+        .where(Request.wallet_id.in_(wallet_ids))
+        .group_by(Request.wallet_id, Request.asset_group)
+    )
+
+
 def select_query(*conditions):
     """Select Request rows based on provided conditions."""
     return db.select(Request).where(*conditions)
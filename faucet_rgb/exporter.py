@@ -0,0 +1,33 @@
+"""Faucet blueprint exposing metrics in the Prometheus text format."""
+
+from flask import Blueprint, Response, current_app
+
+from .database import STATUS_MAP, db, status_totals_query
+from .metrics import Metrics
+from .utils import operator_auth
+
+bp = Blueprint("exporter", __name__)
+
+
+@bp.route("/metrics", methods=["GET"])
+@operator_auth
+def metrics():
+    """Return metrics in the Prometheus text format.
+
+    Besides the in-process histograms, counters and gauges (see
+    faucet_rgb/metrics.py), the number of requests by status (queue depth) is
+    exposed. Requests are only counted by status, which is served by the
+    status indexes, so scrapes don't compute the full request statistics.
+    """
+    app_metrics: Metrics = current_app.config["METRICS"]
+
+    totals = {name: 0 for name in STATUS_MAP.values()}
+    for status, count in db.session.execute(status_totals_query()):
+        totals[STATUS_MAP.get(status, str(status))] = count
+    gauges = {
+        "faucet_requests": (
+            "requests, by status",
+            {(("status", status),): count for status, count in totals.items()},
+        )
+    }
+    return Response(app_metrics.render(gauges), mimetype="text/plain; version=0.0.4")
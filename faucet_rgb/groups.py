@@ -0,0 +1,149 @@
+"""Compiled asset group configuration module."""
+
+from collections.abc import Iterator, Mapping
+from datetime import datetime
+
+from flask import Config
+
+from .settings import DistributionMode
+
+
+class _Frozen:  # pylint: disable=too-few-public-methods
+    """Base for read-only, slotted objects."""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def _set(self, **attrs):
+        for name, value in attrs.items():
+            object.__setattr__(self, name, value)
+
+
+class GroupAsset(_Frozen):  # pylint: disable=too-few-public-methods
+    """An asset configured in an asset group."""
+
+    __slots__ = ("asset_id", "amount", "group_name")
+    asset_id: str
+    amount: int
+    group_name: str
+
+    def __init__(self, asset_id: str, amount: int, group_name: str):
+        self._set(asset_id=asset_id, amount=amount, group_name=group_name)
+
+    def __repr__(self):
+        return f"GroupAsset({self.asset_id!r}, {self.amount!r}, {self.group_name!r})"
+
+
+class AssetGroup(_Frozen):  # pylint: disable=too-few-public-methods
+    """An asset group, with its distribution configuration already parsed.
+
+    Attributes:
+    - name: group name
+    - label: group label
+    - distribution: distribution configuration, as configured
+    - public_distribution: distribution configuration returned to users, with
+      no random seed, which would allow to predict the draw
+    - mode: distribution mode
+    - request_window_open: request window open (random mode only)
+    - request_window_close: request window close (random mode only)
+    - random_seed: seed for the draw of winners, if configured (random mode only)
+    - assets: tuple of assets in the group
+    """
+
+    __slots__ = (
+        "name",
+        "label",
+        "distribution",
+        "public_distribution",
+        "mode",
+        "request_window_open",
+        "request_window_close",
+        "random_seed",
+        "assets",
+    )
+    name: str
+    label: str
+    distribution: dict
+    public_distribution: dict
+    mode: DistributionMode
+    request_window_open: datetime | None
+    request_window_close: datetime | None
+    random_seed: str | None
+    assets: tuple[GroupAsset, ...]
+
+    def __init__(self, name: str, group_data: dict, date_format: str):
+        dist_conf = group_data["distribution"]
+        mode = DistributionMode(dist_conf["mode"])
+        req_win_open = req_win_close = random_seed = None
+        public_dist = dict(dist_conf)
+        if mode == DistributionMode.RANDOM:
+            random_params = dist_conf["random_params"]
+            public_dist["random_params"] = {
+                key: value for key, value in random_params.items() if key != "seed"
+            }
+            req_win_open = datetime.strptime(random_params["request_window_open"], date_format)
+            req_win_close = datetime.strptime(random_params["request_window_close"], date_format)
+            if random_params.get("seed") is not None:
+                random_seed = str(random_params["seed"])
+        self._set(
+            name=name,
+            label=group_data["label"],
+            distribution=dist_conf,
+            public_distribution=public_dist,
+            mode=mode,
+            request_window_open=req_win_open,
+            request_window_close=req_win_close,
+            random_seed=random_seed,
+            assets=tuple(
+                GroupAsset(a["asset_id"], a["amount"], name) for a in group_data["assets"]
+            ),
+        )
+
+    def is_window_open(self, now: datetime):
+        """Return if the request window is open at the given time.
+
+        Groups not in random distribution mode have no request window.
+        """
+        if self.mode != DistributionMode.RANDOM:
+            return True
+        return self.request_window_open <= now <= self.request_window_close
+
+
+class AssetGroups(Mapping):
+    """Read-only mapping of group names to compiled asset groups.
+
+    An asset ID to asset reverse index is also built, for constant-time
+    lookups of the group an asset belongs to.
+    """
+
+    __slots__ = ("_groups", "_assets_by_id")
+
+    def __init__(self, groups: dict[str, AssetGroup]):
+        self._groups = groups
+        self._assets_by_id: dict[str, GroupAsset] = {}
+        for group in groups.values():
+            for asset in group.assets:
+                self._assets_by_id.setdefault(asset.asset_id, asset)
+
+    def __getitem__(self, group_name: str) -> AssetGroup:
+        return self._groups[group_name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._groups)
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def get_asset(self, asset_id: str) -> GroupAsset | None:
+        """Return the configured asset with the given ID, if any."""
+        return self._assets_by_id.get(asset_id)
+
+
+def compile_asset_groups(cfg: Config):
+    """Compile the ASSETS configuration, which needs to have been validated."""
+    date_format = cfg["DATE_FORMAT"]
+    return AssetGroups(
+        {name: AssetGroup(name, data, date_format) for name, data in cfg["ASSETS"].items()}
+    )
@@ -0,0 +1,179 @@
+"""In-process metrics module."""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# histogram buckets (upper bounds) for durations, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# histogram buckets (upper bounds) for DB queries per HTTP request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# histograms: name -> (help, buckets)
+HISTOGRAMS = {
+    "faucet_http_request_duration_seconds": (
+        "HTTP request latency, by endpoint",
+        DURATION_BUCKETS,
+    ),
+    "faucet_http_request_db_queries": (
+        "DB queries run by each HTTP request, by endpoint",
+        QUERY_COUNT_BUCKETS,
+    ),
+    "faucet_http_request_db_duration_seconds": (
+        "time spent running DB queries by each HTTP request, by endpoint",
+        DURATION_BUCKETS,
+    ),
+    "faucet_db_query_duration_seconds": (
+        "DB query latency, for HTTP requests and scheduler jobs",
+        DURATION_BUCKETS,
+    ),
+    "faucet_job_duration_seconds": ("scheduler job duration, by job", DURATION_BUCKETS),
+    "faucet_rgb_lib_call_duration_seconds": (
+        "rgb-lib call latency, by call, for calls outside the sending pipeline stages",
+        DURATION_BUCKETS,
+    ),
+    "faucet_pipeline_stage_duration_seconds": (
+        "sending pipeline stage duration, by stage",
+        DURATION_BUCKETS,
+    ),
+}
+# counters: name -> help
+COUNTERS = {
+    "faucet_http_requests_total": "HTTP requests, by endpoint and status code",
+}
+# gauges set in process: name -> help
+GAUGES = {
+    "faucet_spare_utxos": "spare colorable UTXOs, as of the last scheduler run",
+    "faucet_utxo_pool_target": "spare colorable UTXO pool target, as of the last scheduler run",
+}
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    """Format the given label pairs in the Prometheus text format."""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _render_histogram_series(name: str, buckets: tuple, key: tuple, series: list) -> list[str]:
+    """Return the lines of a histogram series in the Prometheus text format."""
+    counts, total, count = series
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip((*buckets, "+Inf"), counts):
+        cumulative += bucket_count
+        lines.append(f"{name}_bucket{_format_labels((*key, ('le', str(bound))))} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+    lines.append(f"{name}_count{_format_labels(key)} {count}")
+    return lines
+
+
+class Metrics:
+    """Prometheus-style metrics.
+
+    Histograms (see HISTOGRAMS), counters (see COUNTERS) and gauges (see
+    GAUGES) are kept in memory, per set of labels, so they are reset on
+    restart. Recording a value only takes a lock and a bucket lookup, so
+    metrics can be always on. Gauges read from other sources (e.g. the request
+    statistics) are provided when rendering.
+
+    The sending pipeline stages are timed in a histogram labelled by stage,
+    which /control/pipeline also reports (see pipeline_stats).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> labels -> [bucket counts (last is +Inf), sum, count]
+        self._histograms: dict[str, dict[tuple, list]] = {name: {} for name in HISTOGRAMS}
+        # name -> labels -> value
+        self._counters: dict[str, dict[tuple, float]] = {name: {} for name in COUNTERS}
+        # name -> labels -> value
+        self._gauges: dict[str, dict[tuple, float]] = {name: {} for name in GAUGES}
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Observe the duration of the wrapped block in the given histogram, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def rgb_lib_call(self, call: str):
+        """Time the wrapped rgb-lib call."""
+        return self.time("faucet_rgb_lib_call_duration_seconds", call=call)
+
+    def stage(self, stage: str):
+        """Time the wrapped sending pipeline stage."""
+        return self.time("faucet_pipeline_stage_duration_seconds", stage=stage)
+
+    def observe(self, name: str, value: float, **labels):
+        """Observe the provided value in the given histogram."""
+        buckets = HISTOGRAMS[name][1]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name].get(key)
+            if series is None:
+                series = self._histograms[name][key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            series[0][bisect_left(buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increment the given counter by the provided value."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters[name][key] = self._counters[name].get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Set the given gauge to the provided value."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges[name][key] = value
+
+    def pipeline_stats(self) -> dict:
+        """Return the sending pipeline metrics.
+
+        Stage timings (count and total seconds) are read from the stage
+        histogram, along with the values of the unlabelled gauges.
+        """
+        with self._lock:
+            stages = {
+                dict(key)["stage"]: {"count": series[2], "total": series[1]}
+                for key, series in self._histograms[
+                    "faucet_pipeline_stage_duration_seconds"
+                ].items()
+            }
+            gauges = {name: values[()] for name, values in self._gauges.items() if () in values}
+        return {"stages": stages, "gauges": gauges}
+
+    def render(self, gauges: dict[str, tuple[str, dict[tuple, float]]]) -> str:
+        """Return all metrics in the Prometheus text format.
+
+        Gauges are provided as name -> (help, labels -> value).
+        """
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for key, series in sorted(self._histograms[name].items()):
+                    lines += _render_histogram_series(name, buckets, key, series)
+            for name, help_text in COUNTERS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, help_text in GAUGES.items():
+                if self._gauges[name]:
+                    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+                for key, value in sorted(self._gauges[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, (help_text, values) in gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
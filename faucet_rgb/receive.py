@@ -2,23 +2,38 @@
 
 import json
 import random
+import threading
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum
-from logging import Logger
 
 import rgb_lib
-from rgb_lib import Invoice
 from flask import Blueprint, Config, current_app, jsonify, request
 from flask.wrappers import Request as FlaskRequest
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from faucet_rgb.settings import DistributionMode
 
-from .database import Request, count_query, db, delete_query, select_query, update_query
-from .utils import get_current_timestamp, get_logger, get_rgb_asset, is_blinded_utxo
+from .database import (
+    Request,
+    db,
+    insert_requests,
+    requested_groups_query,
+    requested_pairs_query,
+)
+from .groups import AssetGroup, AssetGroups, GroupAsset
+from .tasks import notify_request_queued
+from .utils import ParsedInvoice, get_logger, get_rgb_asset, parse_invoice
 from .utils.wallet import is_walletid_valid
 
 bp = Blueprint("receive", __name__, url_prefix="/receive")
 
+_MIGRATION_CACHE_LOCK = threading.Lock()
+
+# max number of wallet IDs per eligibility query of bulk requests
+_BULK_QUERY_CHUNK_SIZE = 1000
+
 
 class DenyReason(Enum):
     """Reason the request is being denied for."""
@@ -57,25 +72,21 @@ def config(wallet_id: str):
     if not is_walletid_valid(wallet_id):
         return jsonify({"error": "invalied wallet ID"}), 403
 
-    # drop requests in status "new" which are older than a couple minutes
-    time_thresh = get_current_timestamp() - 120
-    db.session.execute(delete_query(Request.status == 10, Request.timestamp < time_thresh))
-    db.session.commit()
-
-    assets: dict = current_app.config["ASSETS"]
+    asset_groups: AssetGroups = current_app.config["ASSET_GROUPS"]
+    allowed_map = _get_requests_allowed(wallet_id, asset_groups)
     groups = {}
-    for group_name, group_data in assets.items():
-        (allowed, _reason) = _is_request_allowed(wallet_id, group_name)
+    for group_name, group in asset_groups.items():
+        (allowed, _reason) = allowed_map[group_name]
         groups[group_name] = {
-            "label": group_data["label"],
-            "distribution": group_data["distribution"],
+            "label": group.label,
+            "distribution": group.public_distribution,
             "requests_left": 1 if allowed else 0,
         }
     return jsonify({"name": current_app.config["NAME"], "groups": groups})
 
 
 @bp.route("/asset", methods=["POST"])
-def request_rgb_asset():  # pylint: disable=too-many-return-statements
+def request_rgb_asset():
     """Request sending configured amount to the provided invoice.
 
     body data:
@@ -96,151 +107,335 @@ def request_rgb_asset():  # pylint: disable=too-many-return-statements
     # if there's no error key, data and invoice should be defined
     assert result["data"] and result["invoice"]
     data = result["data"]
-    invoice: Invoice = result["invoice"]
+    invoice: ParsedInvoice = result["invoice"]
+
+    # check if request is allowed and prepare it
+    # groups already requested from are checked first, with an index-only
+    # query, so double requests are always denied as such; concurrent ones
+    # are denied on insert by the unique (wallet_id, asset_group) index
+    requested_groups = set(db.session.scalars(requested_groups_query(data["wallet_id"])).all())
+    result = _request_rgb_asset_core(
+        data["wallet_id"], invoice, data.get("asset_group"), requested_groups, datetime.now()
+    )
+    if result.get("error"):
+        return _error_response(result)
+    req: Request = result["request"]
 
-    # refuse witness requests if not allowed for network
-    if current_app.config["NETWORK"] not in current_app.config[
-        "WITNESS_ALLOWED_NETWORKS"
-    ] and not is_blinded_utxo(invoice.invoice_data().recipient_id):
-        return (
-            jsonify(
-                {"error": f"witness send not supported on {current_app.config['NETWORK']} network"}
-            ),
-            403,
+    # add request to db, with its final status, asset_id and amount
+    # the unique (wallet_id, asset_group) index prevents double requests
+    # pylint: disable=no-member
+    db.session.add(req)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        _restore_migration_asset(req.asset_group, req.wallet_id, req.asset_id)
+        return _error_response(_denied(req.asset_group, DenyReason.ALREADY_REQUESTED))
+    except SQLAlchemyError:
+        db.session.rollback()
+        _restore_migration_asset(req.asset_group, req.wallet_id, req.asset_id)
+        raise
+    # pylint: enable=no-member
+    logger.debug(
+        "added request %s: asset_id %s, amount %s, status %s",
+        req.idx,
+        req.asset_id,
+        req.amount,
+        req.status,
+    )
+    if req.status == 20:
+        notify_request_queued()
+
+    return jsonify(result["result"])
+
+
+@bp.route("/asset/bulk", methods=["POST"])
+def request_rgb_asset_bulk():  # pylint: disable=too-many-locals
+    """Request sending configured amounts to many invoices at once.
+
+    Operator-only. Body data is either a JSON array or, with content type
+    application/x-ndjson, a stream of JSON objects, one per line, each with:
+    - wallet_id: a sha256 hash
+    - invoice: a valid RGB invoice
+    - asset_group: (optional) group name to be used
+
+    Requests follow the same rules as /receive/asset. Items are validated in
+    parallel, groups already requested from are fetched with set-based
+    queries and allowed requests are inserted in bulk. At most
+    BULK_MAX_REQUESTS requests can be submitted per call.
+
+    Return a result for each item, in order, with its HTTP status code.
+    """
+    logger = get_logger(__name__)
+    cfg = current_app.config
+    auth = request.headers.get("X-Api-Key")
+    if auth != cfg["API_KEY_OPERATOR"]:
+        return jsonify({"error": "unauthorized"}), 401
+
+    items = _get_bulk_items(request)
+    if items is None:
+        return jsonify({"error": "invalid request data"}), 400
+    if len(items) > cfg["BULK_MAX_REQUESTS"]:
+        return jsonify({"error": f"too many requests, max {cfg['BULK_MAX_REQUESTS']}"}), 413
+
+    # validate items (wallet ID, invoice) in parallel
+    with ThreadPoolExecutor(max_workers=cfg["BULK_WORKERS"]) as executor:
+        checked = list(executor.map(_check_bulk_item, items))
+
+    # get groups already requested from, for all wallets at once
+    wallet_ids = {c["data"]["wallet_id"] for c in checked if not c.get("error")}
+    requested_map = _get_requested_groups_map(wallet_ids)
+
+    # apply the admission rules, also denying double requests within the call
+    now = datetime.now()
+    results: list[dict] = []
+    reqs: list[tuple[int, Request]] = []
+    for item in checked:
+        if item.get("error"):
+            results.append(item)
+            continue
+        wallet_id = item["data"]["wallet_id"]
+        requested_groups = requested_map.setdefault(wallet_id, set())
+        result = _request_rgb_asset_core(
+            wallet_id, item["invoice"], item["data"].get("asset_group"), requested_groups, now
         )
+        if result.get("error"):
+            results.append(result)
+            continue
+        requested_groups.add(result["request"].asset_group)
+        reqs.append((len(results), result["request"]))
+        results.append({**result["result"], "code": 200})
+
+    _add_bulk_requests(reqs, results)
+    added = [req for num, req in reqs if results[num]["code"] == 200]
+    logger.info("added %s requests in bulk, %s denied", len(added), len(results) - len(added))
+    queued = sum(req.status == 20 for req in added)
+    if queued:
+        notify_request_queued(queued)
+
+    return jsonify({"results": results})
+
+
+def _request_rgb_asset_core(
+    wallet_id: str,
+    invoice: ParsedInvoice,
+    asset_group: str | None,
+    requested_groups: set[str],
+    now: datetime,
+):
+    """Apply the admission rules to a request and prepare it.
+
+    Return a dict with the request to be added and the result to be returned
+    if allowed, otherwise an error dict (error, code and optional reason).
+    """
+    # pylint: disable=too-many-return-statements
+    cfg = current_app.config
+
+    # refuse witness requests if not allowed for network
+    if cfg["NETWORK"] not in cfg["WITNESS_ALLOWED_NETWORKS"] and not invoice.blinded:
+        return {"error": f"witness send not supported on {cfg['NETWORK']} network", "code": 403}
 
     # choose asset group
-    configured_assets = current_app.config["ASSETS"]
-    asset_group = data.get("asset_group")
-    if asset_group and asset_group not in configured_assets:
-        return jsonify({"error": "invalid asset group"}), 404
-    asset = None
+    asset_groups: AssetGroups = cfg["ASSET_GROUPS"]
+    if asset_group and asset_group not in asset_groups:
+        return {"error": "invalid asset group", "code": 404}
     if asset_group is None:
         # chose randomly from non-migration groups
-        asset_group = random.choice(list(current_app.config["NON_MIGRATION_GROUPS"]))
-    asset = random.choice(list(configured_assets[asset_group]["assets"]))
+        asset_group = random.choice(list(cfg["NON_MIGRATION_GROUPS"]))
+    asset: GroupAsset | None = random.choice(asset_groups[asset_group].assets)
 
     # check if request is allowed
-    (allowed, reason) = _is_request_allowed(data["wallet_id"], asset_group)
+    (allowed, reason) = _is_request_allowed(wallet_id, asset_group, requested_groups, now)
     if not allowed:
         assert reason  # should always be set if allowed = False
-        return (
-            jsonify(
-                {
-                    "error": f"wallet has no right to request an asset from group {asset_group}",
-                    "reason": REASON_MAP[reason.value],
-                }
-            ),
-            403,
-        )
+        return _denied(asset_group, reason)
 
     # handle asset migration
-    non_mig_groups = current_app.config["NON_MIGRATION_GROUPS"]
-    is_mig_request = asset_group not in non_mig_groups
-    if is_mig_request:
+    if asset_group not in cfg["NON_MIGRATION_GROUPS"]:
         # wallet is entitled to a migration > detect the asset to be sent
+        asset = _pop_migration_asset(asset_group, wallet_id)
+        if asset is None:
+            # a concurrent request from the same wallet got to it first
+            return _denied(asset_group, DenyReason.ALREADY_REQUESTED)
+    assert asset
+
+    # prepare asset data
+    asset_metadata = get_rgb_asset(asset.asset_id)
+    if asset_metadata is None:
+        _restore_migration_asset(asset_group, wallet_id, asset.asset_id)
+        return {"error": "internal error getting asset data", "code": 500}
+    asset_data = {
+        "asset_id": asset.asset_id,
+        "amount": asset.amount,
+        **asset_metadata,
+    }
+
+    # prepare request, with its final status, asset_id and amount
+    group: AssetGroup = asset_groups[asset_group]
+    status = 25 if group.mode == DistributionMode.RANDOM else 20
+    req = Request(
+        wallet_id,
+        invoice.recipient_id,
+        invoice.invoice,
+        asset_group,
+        asset.asset_id,
+        asset.amount,
+        status,
+        invoice,
+    )
+    return {
+        "request": req,
+        "result": {
+            "asset": asset_data,
+            "distribution": group.public_distribution,
+        },
+    }
+
+
+def _denied(asset_group: str, reason: DenyReason):
+    """Return the error for a request denied for the given reason."""
+    return {
+        "error": f"wallet has no right to request an asset from group {asset_group}",
+        "reason": REASON_MAP[reason.value],
+        "code": 403,
+    }
+
+
+def _error_response(error: dict):
+    """Return the response for the provided error dict."""
+    body = {"error": error["error"]}
+    if "reason" in error:
+        body["reason"] = error["reason"]
+    return jsonify(body), error["code"]
+
+
+def _get_bulk_items(req: FlaskRequest) -> list | None:
+    """Return the items submitted to the bulk endpoint, None if not valid.
+
+    NDJSON lines that are not valid JSON are returned as None items.
+    """
+    if req.mimetype == "application/x-ndjson":
+        items = []
+        for line in req.stream:
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                items.append(None)
+        return items
+    try:
+        items = json.loads(req.data)
+    except json.JSONDecodeError:
+        return None
+    return items if isinstance(items, list) else None
+
+
+def _check_bulk_item(item) -> dict:
+    """Check a bulk request item, parsing its invoice.
+
+    Return the item data and parsed invoice, or an error dict.
+    """
+    if not isinstance(item, dict):
+        return {"error": "invalid request data", "code": 400}
+    if not is_walletid_valid(item.get("wallet_id")):
+        return {"error": "invalid wallet ID", "code": 403}
+    try:
+        invoice = parse_invoice(item.get("invoice"))
+    except (rgb_lib.RgbLibError, TypeError):  # pylint: disable=catching-non-exception
+        return {"error": "invalid invoice", "code": 403}
+    return {"data": item, "invoice": invoice}
+
+
+def _get_requested_groups_map(wallet_ids: Iterable[str]) -> dict[str, set[str]]:
+    """Return the asset groups each given wallet ID has placed requests for."""
+    wallet_ids = list(wallet_ids)
+    requested_map: dict[str, set[str]] = {}
+    for start in range(0, len(wallet_ids), _BULK_QUERY_CHUNK_SIZE):
+        end = start + _BULK_QUERY_CHUNK_SIZE
+        chunk = wallet_ids[start:end]
+        for wallet_id, asset_group in db.session.execute(requested_pairs_query(chunk)):
+            requested_map.setdefault(wallet_id, set()).add(asset_group)
+    return requested_map
+
+
+def _add_bulk_requests(reqs: list[tuple[int, Request]], results: list[dict]):
+    """Add the given requests to the db, with a single INSERT.
+
+    Requests violating the unique (wallet_id, asset_group) index, because of a
+    concurrent request, are skipped by the database and denied, their results
+    are updated accordingly and their migration entitlements are put back.
+    """
+    try:
+        inserted = insert_requests([req for _, req in reqs])
+    except SQLAlchemyError:
+        db.session.rollback()
+        for _, req in reqs:
+            _restore_migration_asset(req.asset_group, req.wallet_id, req.asset_id)
+        raise
+    for num, req in reqs:
+        if (req.wallet_id, req.asset_group) not in inserted:
+            _restore_migration_asset(req.asset_group, req.wallet_id, req.asset_id)
+            results[num] = _denied(req.asset_group, DenyReason.ALREADY_REQUESTED)
+
+
+def _pop_migration_asset(asset_group: str, wallet_id: str) -> GroupAsset | None:
+    """Remove the wallet (and possibly the whole group) from the migration cache.
+
+    Return the asset the wallet is entitled to, if it was still in the cache.
+    The cache is shared by all request threads, so it is updated under a lock.
+    """
+    with _MIGRATION_CACHE_LOCK:
         mig_cache = current_app.config["ASSET_MIGRATION_CACHE"]
-        asset = mig_cache[asset_group].get(data["wallet_id"])
-        # remove the user (and possibly the whole group) from migration cache
-        del mig_cache[asset_group][data["wallet_id"]]
-        if not mig_cache[asset_group]:
+        mig_cache_group = mig_cache.get(asset_group)
+        if mig_cache_group is None:
+            return None
+        asset = mig_cache_group.pop(wallet_id, None)
+        if not mig_cache_group:
             del mig_cache[asset_group]
+    return asset
 
-    return _request_rgb_asset_core(data["wallet_id"], invoice, asset_group, asset, logger)
 
+def _restore_migration_asset(asset_group: str, wallet_id: str, asset_id: str):
+    """Put back in the migration cache the asset a wallet is entitled to.
 
-def _request_rgb_asset_core(
-    wallet_id: str, invoice: Invoice, asset_group: str, asset: dict, logger: Logger
-):
-    # add request to db so max requests check works right away (no double req)
-    # pylint: disable=no-member
-    invoice_str = invoice.invoice_string()
-    db.session.add(
-        Request(
-            wallet_id, invoice.invoice_data().recipient_id, invoice_str, asset_group, None, None
-        )
-    )
-    req = db.session.scalars(
-        select_query(
-            Request.wallet_id == wallet_id,
-            Request.invoice == invoice_str,
-            Request.asset_group == asset_group,
-            Request.status == 10,
-        )
-    ).all()
-    assert len(req) == 1
-    req_idx = req[0].idx
-    db.session.commit()
-    # pylint: enable=no-member
+    This is called when a request popped from the cache (see
+    _pop_migration_asset) cannot be added, so the wallet can retry. Nothing is
+    done for groups not for migration.
+    """
+    cfg = current_app.config
+    if asset_group in cfg["NON_MIGRATION_GROUPS"]:
+        return
+    asset_groups: AssetGroups = cfg["ASSET_GROUPS"]
+    asset = next(a for a in asset_groups[asset_group].assets if a.asset_id == asset_id)
+    with _MIGRATION_CACHE_LOCK:
+        cfg["ASSET_MIGRATION_CACHE"].setdefault(asset_group, {}).setdefault(wallet_id, asset)
 
-    # prepare asset data
-    rgb_asset, schema = get_rgb_asset(asset["asset_id"])
-    if rgb_asset is None:
-        return jsonify({"error": "internal error getting asset data"}), 500
-    asset_data = {
-        "asset_id": asset["asset_id"],
-        "schema": schema,
-        "amount": asset["amount"],
-        "name": rgb_asset.name,
-        "precision": rgb_asset.precision,
-        "details": None,
-        "ticker": None,
-    }
-    if hasattr(rgb_asset, "details"):
-        asset_data["details"] = rgb_asset.details
-    if hasattr(rgb_asset, "ticker"):
-        asset_data["ticker"] = rgb_asset.ticker
-
-    # update request on db: update status, set asset_id and amount
-    dist_conf = current_app.config["ASSETS"][asset_group]["distribution"]
-    dist_mode = DistributionMode(dist_conf["mode"])
-    new_status = 25 if dist_mode == DistributionMode.RANDOM else 20
-    # pylint: disable=no-member
-    logger.debug(
-        "setting request %s: asset_id %s, amount %s, status %s",
-        req_idx,
-        asset["asset_id"],
-        asset["amount"],
-        new_status,
-    )
-    db.session.execute(
-        update_query(Request.idx == req_idx).values(
-            status=new_status, asset_id=asset["asset_id"], amount=asset["amount"]
-        )
-    )
-    db.session.commit()
-    # pylint: enable=no-member
 
-    return jsonify(
-        {
-            "asset": asset_data,
-            "distribution": dist_conf,
-        }
-    )
+def _get_requests_allowed(wallet_id: str, group_names: Iterable[str]):
+    """Return if a request should be allowed or denied, for each given group.
+
+    Groups the wallet has already requested from are fetched with a single
+    query, then each group is evaluated in memory.
+    """
+    requested_groups = set(db.session.scalars(requested_groups_query(wallet_id)).all())
+    now = datetime.now()
+    return {
+        group_name: _is_request_allowed(wallet_id, group_name, requested_groups, now)
+        for group_name in group_names
+    }
 
 
-def _is_request_allowed(wallet_id: str, group_name: str):
+def _is_request_allowed(wallet_id: str, group_name: str, requested_groups: set[str], now: datetime):
     """Return if a request should be allowed or denied."""
     # deny request if user has already placed a request for this group
-    reqs_count = db.session.scalar(
-        count_query(Request.wallet_id == wallet_id, Request.asset_group == group_name)
-    )
-    if reqs_count:
+    if group_name in requested_groups:
         return (False, DenyReason.ALREADY_REQUESTED)
 
-    # deny based on distribution mode
-    dist_conf = current_app.config["ASSETS"][group_name]["distribution"]
-    dist_mode = DistributionMode(dist_conf["mode"])
-    if dist_mode == DistributionMode.RANDOM:
-        req_win_open = dist_conf["random_params"]["request_window_open"]
-        req_win_close = dist_conf["random_params"]["request_window_close"]
-        date_format = current_app.config["DATE_FORMAT"]
-        req_win_open = datetime.strptime(req_win_open, date_format)
-        req_win_close = datetime.strptime(req_win_close, date_format)
-        now = datetime.now()
-        # deny requests outside the configured request window
-        if now < req_win_open or now > req_win_close:
-            return (False, DenyReason.OUSTIDE_REQUEST_WINDOW)
+    # deny requests outside the configured request window (random mode only)
+    group: AssetGroup = current_app.config["ASSET_GROUPS"][group_name]
+    if not group.is_window_open(now):
+        return (False, DenyReason.OUSTIDE_REQUEST_WINDOW)
 
     # deny based on migration configuration and status
     if group_name not in current_app.config["NON_MIGRATION_GROUPS"]:
@@ -271,7 +466,7 @@ def _receive_asset_checks(req: FlaskRequest, cfg: Config):
         return {"error": "invalid wallet ID", "code": 403}
     # parse invoice
     try:
-        invoice = Invoice(data.get("invoice"))
+        invoice = parse_invoice(data.get("invoice"))
     except (rgb_lib.RgbLibError, TypeError):  # pylint: disable=catching-non-exception
         return {"error": "invalid invoice", "code": 403}
 
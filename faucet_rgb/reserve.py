@@ -2,29 +2,29 @@
 
 import rgb_lib
 
-from flask import Blueprint, current_app, jsonify, request
+from flask import Blueprint, current_app, jsonify
 from rgb_lib import Wallet
 
+from .utils import operator_auth, wallet_required
+
 bp = Blueprint("reserve", __name__, url_prefix="/reserve")
 
 
 @bp.route("/top_up_btc", methods=["GET"])
+@operator_auth
+@wallet_required
 def top_up_btc():
     """Return an address to top-up the faucet's Bitcoin reserve."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
     wallet: Wallet = current_app.config["WALLET"]
     new_addr = wallet.get_address()
     return jsonify({"address": new_addr})
 
 
 @bp.route("/top_up_rgb", methods=["GET"])
+@operator_auth
+@wallet_required
 def top_up_rgb():
     """Return an RGB invoice to top-up the faucet's RGB asset reserve."""
-    auth = request.headers.get("X-Api-Key")
-    if auth != current_app.config["API_KEY_OPERATOR"]:
-        return jsonify({"error": "unauthorized"}), 401
     wallet: Wallet = current_app.config["WALLET"]
     blind_data = wallet.blind_receive(
         None,
@@ -1,5 +1,8 @@
 """Scheduler module."""
 
+import contextlib
+import math
+import time
 import traceback
 from typing import Sequence
 
@@ -9,12 +12,27 @@ from flask import Flask, current_app
 from flask_apscheduler import APScheduler
 from rgb_lib import Unspent, Wallet
 
-from .database import Request, db, select_query, update_query
+from .database import (
+    BATCH_STATUS_MAP,
+    STATUS_MAP,
+    Batch,
+    Request,
+    claim_requests,
+    count_query,
+    db,
+    pending_query,
+    serve_batch,
+    update_query,
+)
+from .metrics import Metrics
 from .utils import (
+    build_recipient,
     create_witness_utxos,
+    get_current_timestamp,
     get_logger,
     get_recipient,
     get_recipient_map_stats,
+    get_spare_utxos,
 )
 
 scheduler = APScheduler()
@@ -30,88 +48,285 @@ def get_app() -> Flask:
     return scheduler.app
 
 
-def send_next_batch(spare_utxos: list[Unspent]):
+def get_utxo_pool_target(cfg) -> int:
+    """Return the number of spare colorable UTXOs to keep available.
+
+    The pool is sized from the request arrival rate over the last
+    UTXO_POOL_RATE_WINDOW seconds, to cover the requests expected in the next
+    UTXO_POOL_LOOKAHEAD seconds, plus one as the biggest spare UTXO is not
+    counted as available (see get_spare_available). The target is never less
+    than SPARE_UTXO_NUM nor more than UTXO_POOL_MAX.
+    """
+    window = cfg["UTXO_POOL_RATE_WINDOW"]
+    since = get_current_timestamp() - window
+    arrivals = db.session.scalar(
+        count_query(Request.status.in_(list(STATUS_MAP)), Request.timestamp >= since)
+    )
+    expected = math.ceil(arrivals * cfg["UTXO_POOL_LOOKAHEAD"] / window)
+    return max(cfg["SPARE_UTXO_NUM"], min(expected + 1, cfg["UTXO_POOL_MAX"]))
+
+
+def provision_utxo_pool(cfg, spare_utxos: list[Unspent]) -> int:
+    """Create spare colorable UTXOs, up to the pool target, if needed.
+
+    Return the number of created UTXOs.
+    """
+    metrics: Metrics = cfg["METRICS"]
+    target = get_utxo_pool_target(cfg)
+    metrics.set_gauge("faucet_utxo_pool_target", target)
+    metrics.set_gauge("faucet_spare_utxos", len(spare_utxos))
+    if len(spare_utxos) >= target:
+        return 0
+    wallet: Wallet = cfg["WALLET"]
+    with metrics.stage("utxo_pool"):
+        with contextlib.suppress(rgb_lib.RgbLibError.AllocationsAlreadyAvailable):
+            created = wallet.create_utxos(
+                cfg["ONLINE"],
+                True,
+                target,
+                cfg["UTXO_SIZE"],
+                cfg["FEE_RATE"],
+                False,
+            )
+            cfg["WALLET_STATE"].mark_stale()
+            return created
+    return 0
+
+
+def send_batches(spare_utxos: list[Unspent]):
+    """Send queued requests in batches, oldest first.
+
+    The pending queue is split into batches of at most MAX_BATCH_RECIPIENTS
+    requests each, up to MAX_BATCHES_PER_RUN batches are sent. Sending stops at
+    the first failed batch, as the following ones would likely fail as well.
+    Pending requests with an expired invoice are set as unmet first, as they
+    could not be sent.
+
+    No batch is built while a batch that has not been broadcast is waiting to
+    be retried (see resume_batches), as its transaction spends UTXOs that a
+    new batch could select as well.
+
+    Return the list of batch results (True if sent, False if failed).
+    """
+    with get_app().app_context():
+        logger = get_logger(__name__)
+        cfg = current_app.config
+
+        expired = _expire_requests()
+        if expired:
+            logger.warning("%s pending requests with an expired invoice set as unmet", expired)
+
+        unsent_batch = db.session.scalar(
+            db.select(Batch.idx).where(Batch.status.in_((5, 10, 20))).limit(1)
+        )
+        if unsent_batch is not None:
+            logger.warning("batch %s is waiting to be broadcast, not sending", unsent_batch)
+            return []
+
+        results = []
+        for num in range(cfg["MAX_BATCHES_PER_RUN"]):
+            if num:
+                # previous batches have used spare UTXOs
+                spare_utxos = get_spare_utxos(cfg)
+            sent = send_next_batch(spare_utxos)
+            if sent is None:
+                break  # no more requests to process
+            results.append(sent)
+            if not sent:
+                break
+        if results:
+            logger.info("%s batches sent, %s failed", results.count(True), results.count(False))
+        return results
+
+
+def _expire_requests() -> int:
+    """Set pending requests with an expired invoice as unmet, return their number."""
+    expired = db.session.execute(
+        update_query(
+            Request.status == 20,
+            Request.expiration.is_not(None),
+            Request.expiration <= get_current_timestamp(),
+        ).values(status=45)
+    ).rowcount  # type: ignore[attr-defined]
+    db.session.commit()
+    return expired
+
+
+def send_next_batch(spare_utxos: list[Unspent]) -> bool | None:
     """Send the next batch of queued requests.
 
+    The oldest pending requests are claimed, at most MAX_BATCH_RECIPIENTS
+    of them, so oversized batches (slow to build, exceeding allocation slots)
+    are never attempted.
+
     If the SINGLE_ASSET_SEND option is True, only send a single asset per
     batch, which should help to:
     - keep asset histories separate
     - keep number of unspendable UTXOs low
+
+    Return if the batch has been sent, or None if there was nothing to send.
     """
     with get_app().app_context():
         logger = get_logger(__name__)
         cfg = current_app.config
 
-        # get requests to be processed
-        stmt = select_query(Request.status == 20)
-        pending_reqs = db.session.scalars(stmt).all()
-        if not pending_reqs:
-            print("no pending reqs")
-            return  # no requests to process
+        # claim requests to be processed
+        stmt = pending_query()
         if cfg["SINGLE_ASSET_SEND"]:
             # filter for asset ID of oldest request
-            oldest_req = pending_reqs[0]
-            stmt = stmt.where(Request.asset_id == oldest_req.asset_id)
-            pending_reqs = db.session.scalars(stmt).all()
+            oldest_req = db.session.scalars(stmt.limit(1)).first()
+            if oldest_req is not None:
+                stmt = pending_query(Request.asset_id == oldest_req.asset_id)
+        metrics: Metrics = cfg["METRICS"]
+        with metrics.stage("claim"):
+            pending_reqs = claim_requests(stmt.limit(cfg["MAX_BATCH_RECIPIENTS"]), cfg["NODE_ID"])
+        if not pending_reqs:
+            print("no pending reqs")
+            return None  # no requests to process
 
         # get asset set
         asset_id_set = {r.asset_id for r in pending_reqs}
 
         # prepare recipient map
         recipient_map = {}
-        for asset_id in asset_id_set:
-            # get list of recipients that need to receive this asset
-            recipient_list = []
-            for req in pending_reqs:
-                if req.asset_id == asset_id:
-                    recipient = get_recipient(req.invoice, req.amount, cfg)
-                    recipient_list.append(recipient)
-            recipient_map[asset_id] = recipient_list
+        with metrics.stage("prepare"):
+            for asset_id in asset_id_set:
+                # get list of recipients that need to receive this asset
+                recipient_list = []
+                for req in pending_reqs:
+                    if req.asset_id == asset_id:
+                        recipient_list.append(_get_request_recipient(req, cfg))
+                recipient_map[asset_id] = recipient_list
 
         # batch stats
         stats = get_recipient_map_stats(recipient_map)
 
         # create additional UTXOs as needed
-        created = create_witness_utxos(cfg, stats, spare_utxos)
+        # the UTXO pool is normally provisioned ahead of demand (see
+        # provision_utxo_pool), so this is only a fallback
+        with metrics.stage("witness_utxos"):
+            created = create_witness_utxos(cfg, stats, spare_utxos)
         logger.info("%s additional UTXOs created", created)
 
         # try sending
-        _try_send(pending_reqs, cfg, recipient_map, stats)
+        return _try_send(pending_reqs, cfg, recipient_map, stats)
+
+
+def _get_request_recipient(req: Request, cfg):
+    """Return the recipient for the given request.
+
+    The recipient is built from the invoice data stored on admission, the
+    invoice is only parsed for requests that have none.
+    """
+    if req.recipient_type is None:
+        return get_recipient(req.invoice, req.amount, cfg)
+    return build_recipient(
+        req.recipient_id,
+        req.recipient_type == "BLIND",
+        req.transport_endpoints,
+        req.amount,
+        cfg,
+    )
+
+
+def resume_batches(cfg) -> list[bool]:
+    """Resume sending the batches that have not been broadcast yet.
+
+    Requests of broadcast batches that have not been served, e.g. if the
+    update failed, are served first. Batches interrupted while being prepared
+    are failed, along with their pending rgb-lib transfers, as their
+    transaction might have been partially built, and their requests are
+    released back to pending.
 
+    This is only called by the scheduler leader, so batches left by other
+    nodes (e.g. one that crashed or has been renamed), which no longer hold
+    the scheduler lease, are taken over: they are recorded as sent by this
+    node, along with their requests, then resumed. If the PSBT cannot be
+    broadcast by this node's wallet, the batch is failed after
+    BATCH_MAX_ATTEMPTS, as any other (see _advance_batch).
 
-def _try_send(reqs: Sequence[Request], cfg, recipient_map, stats):
-    """Try to send."""
+    Return the list of batch results (True if sent).
+    """
+    logger = get_logger(__name__)
+
+    # serve the requests of broadcast batches that have not been served
+    served = db.session.execute(
+        update_query(
+            Request.status == 30,
+            Request.batch_idx.in_(db.select(Batch.idx).where(Batch.status == 30)),
+        ).values(status=40)
+    ).rowcount  # type: ignore[attr-defined]
+    db.session.commit()
+    if served:
+        logger.warning("served %s requests of batches already broadcast", served)
+
+    batches = db.session.scalars(
+        db.select(Batch).where(Batch.status.in_((5, 10, 20))).order_by(Batch.idx)
+    ).all()
+    results = []
+    for batch in batches:
+        if batch.status == 5:
+            logger.warning("failing batch %s, interrupted while being prepared", batch.idx)
+            _fail_unsent_batch(batch, cfg)
+            results.append(False)
+            continue
+        if batch.node_id != cfg["NODE_ID"]:
+            logger.warning("taking over batch %s from node %s", batch.idx, batch.node_id)
+            batch.node_id = cfg["NODE_ID"]
+            db.session.execute(
+                update_query(Request.batch_idx == batch.idx, Request.status == 30).values(
+                    claimed_by=cfg["NODE_ID"]
+                )
+            )
+            db.session.commit()
+        logger.info("resuming %s batch %s", BATCH_STATUS_MAP[batch.status], batch.idx)
+        results.append(_advance_batch(batch, cfg))
+    return results
+
+
+def _try_send(reqs: Sequence[Request], cfg, recipient_map, stats) -> bool:
+    """Try to send.
+
+    The batch and its requests are persisted first, in status "preparing", so
+    a batch interrupted while its transaction is built can be found and failed
+    on resume (see resume_batches). The unsigned PSBT is then persisted before
+    being signed and broadcast (see _advance_batch). If the transaction cannot
+    be built, the batch is failed and the requests are released back to
+    pending, so they can be retried by the next run.
+    """
     with get_app().app_context():
         logger = get_logger(__name__)
         wallet: Wallet = cfg["WALLET"]
-        try:
-            # set request status to "processing"
-            logger.info("sending batch donation")
-            idxs = [req.idx for req in reqs]
-            db.session.execute(update_query(Request.idx.in_(idxs)).values(status=30))
-            db.session.commit()
+        metrics: Metrics = cfg["METRICS"]
 
-            # send assets
-            txid = wallet.send(
-                cfg["ONLINE"],
-                recipient_map,
-                True,
-                cfg["FEE_RATE"],
-                cfg["MIN_CONFIRMATIONS"],
-                False,
-            )
+        # persist the batch before building the transaction
+        batch = Batch(cfg["NODE_ID"], cfg["FEE_RATE"], stats)
+        db.session.add(batch)
+        db.session.flush()
+        db.session.execute(
+            update_query(Request.idx.in_([req.idx for req in reqs])).values(batch_idx=batch.idx)
+        )
+        db.session.commit()
+
+        try:
+            # requests have already been claimed, with status "processing"
             logger.info(
-                "batch donation (%s assets, %s recipients total, %s witnesses) sent with TXID: %s",
+                "sending batch donation (%s assets, %s recipients total, %s witnesses)",
                 stats["assets"],
                 stats["recipients"],
                 stats["witnesses"],
-                txid,
             )
 
-            # update status for served requests
-            for req in reqs:
-                db.session.execute(update_query(Request.idx == req.idx).values(status=40))
-            db.session.commit()
+            # build the transaction
+            start = time.perf_counter()
+            with metrics.stage("send_begin"):
+                unsigned_psbt = wallet.send_begin(
+                    cfg["ONLINE"],
+                    recipient_map,
+                    True,
+                    cfg["FEE_RATE"],
+                    cfg["MIN_CONFIRMATIONS"],
+                )
         except rgb_lib.RgbLibError.InsufficientAllocationSlots:
             logger.error("Failed to send: not enough allocation slots")
         except rgb_lib.RgbLibError.InsufficientAssignments:
@@ -120,3 +335,120 @@ def _try_send(reqs: Sequence[Request], cfg, recipient_map, stats):
             # log any other error, including traceback
             logger.error("Failed to send: unexpected")
             logger.error(traceback.format_exc())
+        else:
+            # persist the unsigned PSBT before signing and broadcasting
+            batch.duration = time.perf_counter() - start
+            batch.set_status(10, unsigned_psbt)
+            db.session.commit()
+            return _advance_batch(batch, cfg)
+
+        _fail_unsent_batch(batch, cfg)
+        return False
+
+
+def _advance_batch(batch: Batch, cfg) -> bool:
+    """Complete the remaining sending phases of the given batch.
+
+    Each completed phase is persisted. If signing fails, the transaction has
+    not been broadcast, so the batch is failed, along with its pending rgb-lib
+    transfers (releasing their UTXOs), and its requests are released back to
+    pending. If broadcasting fails, it is retried by the next runs, up to
+    BATCH_MAX_ATTEMPTS times, then the batch is failed and its requests are
+    left in status "processing", to be checked manually, as the transaction
+    might have been broadcast anyway. Once broadcast, the batch is persisted
+    as such before its requests are served, so it is never broadcast again.
+
+    The time spent on each attempt is added to the batch duration.
+
+    Return if the batch has been broadcast.
+    """
+    logger = get_logger(__name__)
+    wallet: Wallet = cfg["WALLET"]
+    metrics: Metrics = cfg["METRICS"]
+    start = time.perf_counter()
+    try:
+        if batch.status == 10:
+            with metrics.stage("sign"):
+                signed_psbt = wallet.sign_psbt(batch.psbt)
+            batch.set_status(20, signed_psbt)
+            db.session.commit()
+        with metrics.stage("send_end"):
+            result = wallet.send_end(cfg["ONLINE"], batch.psbt, False)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.error("Failed to send batch %s (%s)", batch.idx, BATCH_STATUS_MAP[batch.status])
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        batch.attempts += 1
+        batch.duration += time.perf_counter() - start
+        if batch.status == 10:
+            _fail_unsent_batch(batch, cfg)
+        elif batch.attempts >= cfg["BATCH_MAX_ATTEMPTS"]:
+            batch.set_status(45)
+            logger.error(
+                "batch %s failed after %s attempts, its requests need to be checked manually",
+                batch.idx,
+                batch.attempts,
+            )
+        db.session.commit()
+        return False
+
+    batch.duration += time.perf_counter() - start
+    batch.set_broadcast(result.txid)
+    db.session.commit()
+    logger.info("batch donation %s sent with TXID: %s", batch.idx, result.txid)
+    cfg["WALLET_STATE"].mark_stale()
+
+    # update status for served requests
+    with metrics.stage("update"):
+        serve_batch(batch.idx)
+    return True
+
+
+def _fail_unsent_batch(batch: Batch, cfg):
+    """Fail a batch that has not been broadcast, releasing its requests.
+
+    Its pending rgb-lib transfers are failed as well, releasing their UTXOs.
+    """
+    batch.set_status(45)
+    _fail_batch_transfers(batch, cfg)
+    _release_requests(
+        db.session.scalars(db.select(Request.idx).where(Request.batch_idx == batch.idx)).all()
+    )
+
+
+def _fail_batch_transfers(batch: Batch, cfg):
+    """Fail the pending rgb-lib transfers of a batch that has not been broadcast.
+
+    The rgb-lib batch transfer index is not known before broadcasting, so the
+    transfers are found by asset and recipient IDs of the batch requests.
+    """
+    logger = get_logger(__name__)
+    wallet: Wallet = cfg["WALLET"]
+    reqs = db.session.execute(
+        db.select(Request.asset_id, Request.recipient_id).where(Request.batch_idx == batch.idx)
+    ).all()
+    recipient_ids = {req.recipient_id for req in reqs}
+    try:
+        batch_transfer_idxs = {
+            transfer.batch_transfer_idx
+            for asset_id in {req.asset_id for req in reqs}
+            for transfer in wallet.list_transfers(asset_id)
+            if transfer.kind == rgb_lib.TransferKind.SEND
+            and transfer.status == rgb_lib.TransferStatus.WAITING_COUNTERPARTY
+            and transfer.recipient_id in recipient_ids
+        }
+        for batch_transfer_idx in batch_transfer_idxs:
+            wallet.fail_transfers(cfg["ONLINE"], batch_transfer_idx, False, False)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.error("Failed to fail the transfers of batch %s", batch.idx)
+        logger.error(traceback.format_exc())
+
+
+def _release_requests(idxs: Sequence[int]):
+    """Release the given claimed requests back to pending."""
+    db.session.execute(
+        update_query(Request.idx.in_(idxs), Request.status == 30).values(
+            status=20, claimed_by=None, batch_idx=None
+        )
+    )
+    db.session.commit()
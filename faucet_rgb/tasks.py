@@ -1,28 +1,109 @@
 """Scheduler tasks module."""
 
-import contextlib
+import functools
 import random
+import secrets
 
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Iterable, Sequence
 
-import rgb_lib
+from flask import Flask, current_app
 
-from flask import current_app
-from rgb_lib import Wallet
-
-from .database import Request, count_query, db, select_query, update_query
-from .scheduler import get_app, send_next_batch
+from .cache import PendingRequestsCache, RequestStatsCache, WalletRefresher, WalletStateCache
+from .database import (
+    Request,
+    acquire_lease,
+    count_query,
+    db,
+    pending_query,
+    release_lease,
+    select_query,
+    update_query,
+)
+from .groups import AssetGroups
+from .metrics import Metrics
+from .scheduler import (
+    get_app,
+    provision_utxo_pool,
+    resume_batches,
+    scheduler,
+    send_batches,
+)
 from .settings import DistributionMode
 from .utils import get_current_timestamp, get_logger, get_spare_utxos
 
 
+SCHEDULER_LEASE = "scheduler"
+# number of request IDs fetched per round trip when streaming, and max number
+# of request IDs per bulk update
+_STREAM_CHUNK_SIZE = 1000
+
+
+def _hold_scheduler_lease(cfg) -> bool:
+    """Acquire or renew the scheduler lease, return if this node is the leader."""
+    logger = get_logger(__name__)
+    holder = cfg["LEASE_HOLDER_ID"]
+    leader = acquire_lease(SCHEDULER_LEASE, holder, cfg["LEADER_LEASE_TTL"])
+    if leader != cfg["SCHEDULER_LEADER"]:
+        if leader:
+            logger.info("node %s is now the scheduler leader", holder)
+        else:
+            logger.warning("node %s is no more the scheduler leader", holder)
+    cfg["SCHEDULER_LEADER"] = leader
+    return leader
+
+
+def leader_heartbeat():
+    """
+    Leader heartbeat task.
+
+    Keep the scheduler lease renewed while this node is the leader, also
+    during long running jobs, or take it over once the current leader's lease
+    has expired.
+    """
+    with get_app().app_context():
+        _hold_scheduler_lease(current_app.config)
+
+
+def release_scheduler_lease(app: Flask):
+    """Stop the scheduler and release the scheduler lease, if held.
+
+    This is called on clean exits, so that a restarted node, which holds the
+    lease with a new ID, or another node can take over right away instead of
+    waiting for the lease to expire. Running jobs are completed first.
+    """
+    if scheduler.running:
+        scheduler.shutdown()
+    with app.app_context():
+        cfg = current_app.config
+        if not cfg["SCHEDULER_LEADER"]:
+            return
+        release_lease(SCHEDULER_LEASE, cfg["LEASE_HOLDER_ID"])
+        cfg["SCHEDULER_LEADER"] = False
+        get_logger(__name__).info("node %s released the scheduler lease", cfg["LEASE_HOLDER_ID"])
+
+
+def _timed_job(job):
+    """Record the duration of each run of the decorated scheduler job."""
+
+    @functools.wraps(job)
+    def _run():
+        metrics: Metrics = get_app().config["METRICS"]
+        with metrics.time("faucet_job_duration_seconds", job=job.__name__):
+            job()
+
+    return _run
+
+
+@_timed_job
 def batch_donation():
     """
     Batch donation task.
 
     First, refresh currently pending transfers so they can settle.
     Then, check if the minimum amount of recipients or the maximum waiting time
-    have been reached. If so, send the next batch of asset donations.
+    have been reached. If so, send the queued asset donations, in batches (see
+    the send_batches function).
 
     If the SINGLE_ASSET_SEND option is True, only consider a single asset. See
     the send_next_batch function for details.
@@ -31,42 +112,43 @@ def batch_donation():
         # get configuration variables
         logger = get_logger(__name__)
         cfg = current_app.config
-        wallet: Wallet = cfg["WALLET"]
 
-        # refresh pending transfers
-        try:
-            wallet.refresh(cfg["ONLINE"], None, [], False)
-        except Exception as err:  # pylint: disable=broad-exception-caught
-            logger.error("error refreshing transfers: %s", repr(err))
+        # only the scheduler leader sends donations
+        if not _hold_scheduler_lease(cfg):
+            return
 
-        # reset status for requests left being processed to "pending"
-        db.session.execute(update_query(Request.status == 30).values(status=20))
+        # refresh pending transfers, attaching to any refresh already in
+        # flight, the wallet state is then reloaded on its next access
+        metrics: Metrics = cfg["METRICS"]
+        refresher: WalletRefresher = cfg["WALLET_REFRESHER"]
+        with metrics.stage("refresh"):
+            refresher.request(wait=True)
+
+        # resume batches left being sent, taking over those of other nodes
+        resume_batches(cfg)
+
+        # reset status for requests left being processed to "pending", only if
+        # not part of a batch: only the leader claims requests, so the ones
+        # claimed by other nodes (e.g. a crashed or renamed one) are taken over
+        db.session.execute(
+            update_query(Request.status == 30, Request.batch_idx.is_(None)).values(
+                status=20, claimed_by=None
+            )
+        )
         db.session.commit()
 
         # make sure colorable UTXOs are available
         spare_utxos = get_spare_utxos(cfg)
         if len(spare_utxos) < cfg["SPARE_UTXO_THRESH"]:
-            with contextlib.suppress(rgb_lib.RgbLibError.AllocationsAlreadyAvailable):
-                created = wallet.create_utxos(
-                    cfg["ONLINE"],
-                    True,
-                    cfg["SPARE_UTXO_NUM"],
-                    cfg["UTXO_SIZE"],
-                    cfg["FEE_RATE"],
-                    False,
-                )
-                logger.info("%s UTXOs created", created)
+            created = provision_utxo_pool(cfg, spare_utxos)
+            logger.info("%s UTXOs created", created)
+            if created:
+                spare_utxos = get_spare_utxos(cfg)
 
         # checks
         request_thresh_reached = False
         enough_time_elapsed = False
-        pending_reqs_count = db.session.scalar(count_query(Request.status == 20))
-        oldest_req = db.session.scalars(select_query(Request.status == 20).limit(1)).first()
-        if pending_reqs_count and cfg["SINGLE_ASSET_SEND"]:
-            assert oldest_req  # pending_reqs_count is poisitive
-            pending_reqs_count = db.session.scalar(
-                count_query(Request.asset_id == oldest_req.asset_id)
-            )
+        pending_reqs_count, oldest_req = _get_pending_stats(cfg)
         # request count against configured threshold
         if pending_reqs_count >= cfg["MIN_REQUESTS"]:
             request_thresh_reached = True
@@ -78,9 +160,159 @@ def batch_donation():
                 enough_time_elapsed = True
 
         if request_thresh_reached or enough_time_elapsed:
-            send_next_batch(spare_utxos)
+            if send_batches(spare_utxos):
+                # replenish the UTXO pool now that the batches have been
+                # broadcast, so the next ones only need to be sent
+                created = provision_utxo_pool(cfg, get_spare_utxos(cfg))
+                logger.info("%s UTXOs created for the next batches", created)
+
+        # run again when the (new) oldest request reaches the max waiting time
+        _schedule_batch_donation(cfg)
+
+
+def refresh_request_stats():
+    """
+    Request statistics task.
+
+    Recompute the cached request statistics, so /control/stats calls are
+    served from memory.
+    """
+    with get_app().app_context():
+        stats: RequestStatsCache = current_app.config["REQUEST_STATS"]
+        stats.refresh()
 
 
+def notify_request_queued(count: int = 1):
+    """Notify the scheduler that the given number of requests have been set as pending.
+
+    If the minimum number of pending requests has been reached, the batch
+    donation job is run right away, else it is scheduled to run when the
+    oldest pending request reaches the maximum waiting time, so there's no need
+    to wait for the next scheduler interval. Pending requests are counted in
+    memory (see PendingRequestsCache), so the scheduler job is only modified
+    when the run is brought forward.
+
+    This needs to be called from an app context. Nothing is done if the
+    scheduler is not running in this process (e.g. on web-only nodes, where
+    the worker notices requests on its next scheduler run).
+    """
+    if not scheduler.running:
+        return
+    cfg = current_app.config
+    pending: PendingRequestsCache = cfg["PENDING_REQUESTS"]
+    run_at = pending.add(count, cfg["MAX_WAIT_MINUTES"] * 60, cfg["MIN_REQUESTS"])
+    if run_at is None:
+        return
+    job = scheduler.get_job("batch_donation")
+    if job is None or job.next_run_time is None:
+        return  # job not scheduled or paused
+    run_time = datetime.fromtimestamp(run_at, timezone.utc)
+    if run_time < job.next_run_time:
+        scheduler.modify_job("batch_donation", next_run_time=run_time)
+
+
+def _get_pending_stats(cfg):
+    """Return the number of pending requests and the oldest one, if any.
+
+    If the SINGLE_ASSET_SEND option is True, only count requests for the asset
+    of the oldest one.
+    """
+    pending_reqs_count = db.session.scalar(count_query(Request.status == 20))
+    oldest_req = db.session.scalars(pending_query().limit(1)).first()
+    if pending_reqs_count and cfg["SINGLE_ASSET_SEND"]:
+        assert oldest_req  # pending_reqs_count is poisitive
+        pending_reqs_count = db.session.scalar(
+            count_query(Request.status == 20, Request.asset_id == oldest_req.asset_id)
+        )
+    return pending_reqs_count, oldest_req
+
+
+def _schedule_batch_donation(cfg):
+    """Bring the next batch donation run forward, if a send is due earlier.
+
+    The run is moved to when the oldest pending request reaches the maximum
+    waiting time. Deadlines already past are left to the regular scheduler
+    interval, to avoid retrying failed sends in a loop. The pending requests
+    cache is reset, for the following notifications of queued requests.
+    """
+    job = scheduler.get_job("batch_donation")
+    if job is None or job.next_run_time is None:
+        return  # job not scheduled or paused
+    pending_reqs_count, oldest_req = _get_pending_stats(cfg)
+    pending: PendingRequestsCache = cfg["PENDING_REQUESTS"]
+    if not pending_reqs_count:
+        pending.reset(0, None)
+        return
+    assert oldest_req  # pending_reqs_count is poisitive
+    deadline = oldest_req.timestamp + cfg["MAX_WAIT_MINUTES"] * 60
+    pending.reset(pending_reqs_count, deadline)
+    run_time = datetime.fromtimestamp(deadline, timezone.utc)
+    if datetime.now(timezone.utc) <= run_time < job.next_run_time:
+        scheduler.modify_job("batch_donation", next_run_time=run_time)
+
+
+def draw_winners(idxs: Sequence[int], count: int, seed: str) -> list[int]:
+    """Draw up to count winners, at random, from the provided request IDs.
+
+    The IDs are sorted and drawn as by draw_winners_streaming, so the draw only
+    depends on the seed and on the request IDs, whether they are loaded in
+    memory or streamed, and it can be reproduced for auditing.
+    """
+    return draw_winners_streaming(sorted(idxs), count, seed)
+
+
+def draw_winners_streaming(idxs: Iterable[int], count: int, seed: str) -> list[int]:
+    """Draw up to count winners, at random, from the provided stream of request IDs.
+
+    Reservoir sampling is used, so only the winners are kept in memory. The
+    draw only depends on the seed and on the request IDs, in stream order, so
+    it can be reproduced for auditing as long as they are streamed sorted.
+    """
+    rng = random.Random(seed)
+    winners: list[int] = []
+    if count <= 0:
+        return winners
+    for num, idx in enumerate(idxs):
+        if num < count:
+            winners.append(idx)
+        else:
+            pos = rng.randrange(num + 1)
+            if pos < count:
+                winners[pos] = idx
+    return sorted(winners)
+
+
+def _draw_asset_winners(cfg, asset_id: str, balance: int, seed: str) -> tuple[list[int], int]:
+    """Draw winners among the waiting requests for the given asset.
+
+    Requests are locked, so concurrent nodes cannot draw from the same ones.
+    Up to RANDOM_STREAM_THRESHOLD requests, their IDs are loaded in memory,
+    otherwise they are streamed from the database. Return the winners and the
+    total number of waiting requests.
+    """
+    conditions = (Request.asset_id == asset_id, Request.status == 25)
+    total = db.session.scalar(count_query(*conditions))
+    stmt = (
+        select_query(*conditions)
+        .with_only_columns(Request.idx)
+        .order_by(Request.idx)
+        .with_for_update()
+    )
+    if total <= cfg["RANDOM_STREAM_THRESHOLD"]:
+        return draw_winners(db.session.scalars(stmt).all(), balance, seed), total
+    idxs = db.session.scalars(stmt.execution_options(yield_per=_STREAM_CHUNK_SIZE))
+    return draw_winners_streaming(idxs, balance, seed), total
+
+
+def _set_requests_pending(idxs: Sequence[int]):
+    """Set the given requests as pending, in chunks to bound statement size."""
+    for start in range(0, len(idxs), _STREAM_CHUNK_SIZE):
+        end = start + _STREAM_CHUNK_SIZE
+        chunk = idxs[start:end]
+        db.session.execute(update_query(Request.idx.in_(chunk)).values(status=20))
+
+
+@_timed_job
 def random_distribution():
     """
     Random distribution task.
@@ -88,45 +320,48 @@ def random_distribution():
     Update requests for random distribution asset groups:
     - choose random requests from received ones and set them as pending
     - set remaining requests as unmet
+
+    Winners are drawn from request IDs only and both updates are bulk ones,
+    committed in a single transaction per asset.
     """
     with get_app().app_context():
         # get configuration variables
         logger = get_logger(__name__)
         cfg = current_app.config
 
+        # only the scheduler leader distributes assets
+        if not _hold_scheduler_lease(cfg):
+            return
+
         now = datetime.now()
-        for group, val in current_app.config["ASSETS"].items():
+        asset_groups: AssetGroups = cfg["ASSET_GROUPS"]
+        wallet_state: WalletStateCache = cfg["WALLET_STATE"]
+        for group in asset_groups.values():
             # skip if not random mode or request window has not closed yet
-            dist_conf = current_app.config["ASSETS"][group].get("distribution")
-            dist_mode = DistributionMode(dist_conf["mode"])
-            if dist_mode != DistributionMode.RANDOM:
+            if group.mode != DistributionMode.RANDOM:
                 continue
-            req_win_close = dist_conf["random_params"]["request_window_close"]
-            req_win_close = datetime.strptime(req_win_close, cfg["DATE_FORMAT"])
-            if now < req_win_close:
+            if now < group.request_window_close:
                 continue
 
-            for asset in val["assets"]:
-                asset_id = asset["asset_id"]
-                # get waiting requests for asset
-                reqs = list(
-                    db.session.scalars(
-                        select_query(Request.asset_id == asset_id, Request.status == 25)
-                    ).all()
-                )
+            for asset in group.assets:
+                asset_id = asset.asset_id
                 # get asset future balance (what we expect to be able to send)
-                balance = cfg["WALLET"].get_asset_balance(asset_id).future
-                count = 0
+                asset_balance = wallet_state.get_balance(asset_id)
+                balance = asset_balance.future if asset_balance else 0
                 # choose random requests and set them to pending status
-                while balance > 0 and reqs:
-                    req = random.choice(reqs)
-                    db.session.execute(update_query(Request.idx == req.idx).values(status=20))
-                    db.session.commit()
-                    reqs.remove(req)
-                    balance -= 1
-                    count += 1
+                seed = group.random_seed or secrets.token_hex(16)
+                winners, total = _draw_asset_winners(cfg, asset_id, balance, f"{seed}:{asset_id}")
+                count = len(winners)
                 if count > 0:
-                    logger.info("set %s requests as pending for asset %s", count, asset_id)
+                    _set_requests_pending(winners)
+                    logger.info(
+                        "set %s of %s requests as pending for asset %s (seed %s)",
+                        count,
+                        total,
+                        asset_id,
+                        seed,
+                    )
+                # set remaining requests as unmet, in the same transaction
                 # note: update statements return a CursorResult that have a rowcount
                 reqs_unmet = db.session.execute(
                     update_query(Request.asset_id == asset_id, Request.status == 25).values(
@@ -136,3 +371,5 @@ def random_distribution():
                 db.session.commit()
                 if reqs_unmet > 0:
                     logger.info("set %s requests as unmet for asset %s", reqs_unmet, asset_id)
+                if count > 0:
+                    notify_request_queued(count)
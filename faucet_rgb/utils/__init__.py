@@ -2,12 +2,32 @@
 
 import logging
 import time
+from functools import lru_cache, wraps
+from typing import NamedTuple
 
 import rgb_lib
 
-from flask import Config, current_app
+from flask import Config, current_app, jsonify, request
 from rgb_lib import AssetCfa, AssetNia, Unspent, Wallet
 
+# max number of parsed invoices kept in memory
+INVOICE_PARSE_CACHE_SIZE = 4096
+
+
+class ParsedInvoice(NamedTuple):
+    """Invoice data needed to admit and send a request."""
+
+    invoice: str
+    recipient_id: str
+    recipient_type: str
+    transport_endpoints: tuple[str, ...]
+    expiration: int | None
+
+    @property
+    def blinded(self):
+        """Return if the recipient is a blinded UTXO."""
+        return self.recipient_type == "BLIND"
+
 
 def get_current_timestamp():
     """Return the current timestamp in seconds as a (rounded) integer."""
@@ -22,14 +42,12 @@ def get_logger(name: str):
 
 
 def get_rgb_asset(asset_id: str):
-    """Return the RGB asset with the given ID and its schema, if found."""
-    wallet: Wallet = current_app.config["WALLET"]
-    assets = wallet.list_assets([])
-    for schema in ("nia", "cfa"):
-        for asset in getattr(assets, schema):
-            if asset.asset_id == asset_id:
-                return asset, schema.upper()
-    return None, None
+    """Return the metadata of the RGB asset with the given ID, if found.
+
+    Metadata is served from the asset cache, which is reloaded only if the
+    asset is not found.
+    """
+    return current_app.config["ASSET_CACHE"].get(asset_id)
 
 
 def get_asset_dict(assets: list[AssetNia | AssetCfa]):
@@ -62,32 +80,64 @@ def get_asset_dict(assets: list[AssetNia | AssetCfa]):
     return asset_dict
 
 
-def get_recipient(invoice: str, amount: int, cfg: Config):
-    """Return a recipient for the given invoice."""
-    invoice_data = rgb_lib.Invoice(invoice).invoice_data()
-    recipient_id = invoice_data.recipient_id
+@lru_cache(maxsize=INVOICE_PARSE_CACHE_SIZE)
+def parse_invoice(invoice: str) -> ParsedInvoice:
+    """Parse the given invoice, classifying its recipient.
+
+    Results are cached, as the same invoice can be submitted more than once.
+    Raise an RgbLibError if the invoice is not valid.
+    """
+    rgb_invoice = rgb_lib.Invoice(invoice)
+    invoice_data = rgb_invoice.invoice_data()
     # detect if blinded UTXO or script (witness tx)
-    blinded_utxo = is_blinded_utxo(recipient_id)
-    # create Recipient
+    blinded_utxo = is_blinded_utxo(invoice_data.recipient_id)
+    return ParsedInvoice(
+        invoice=rgb_invoice.invoice_string(),
+        recipient_id=invoice_data.recipient_id,
+        recipient_type="BLIND" if blinded_utxo else "WITNESS",
+        transport_endpoints=tuple(invoice_data.transport_endpoints),
+        expiration=invoice_data.expiration_timestamp,
+    )
+
+
+def build_recipient(
+    recipient_id: str,
+    blinded_utxo: bool,
+    transport_endpoints: list[str],
+    amount: int,
+    cfg: Config,
+):
+    """Return a recipient with the provided data."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
     witness_data = None
     if not blinded_utxo:
         witness_data = rgb_lib.WitnessData(
             amount_sat=cfg["AMOUNT_SAT"],
             blinding=None,
         )
-    recipient = rgb_lib.Recipient(
+    return rgb_lib.Recipient(
         recipient_id=recipient_id,
         witness_data=witness_data,
         assignment=rgb_lib.Assignment.FUNGIBLE(amount),
-        transport_endpoints=invoice_data.transport_endpoints,
+        transport_endpoints=transport_endpoints,
+    )
+
+
+def get_recipient(invoice: str, amount: int, cfg: Config):
+    """Return a recipient for the given invoice."""
+    parsed = parse_invoice(invoice)
+    return build_recipient(
+        parsed.recipient_id,
+        parsed.blinded,
+        list(parsed.transport_endpoints),
+        amount,
+        cfg,
     )
-    return recipient
 
 
 def get_spare_utxos(config: Config):
-    """Return the list of spare colorable UTXOs."""
-    wallet: Wallet = config["WALLET"]
-    unspents = wallet.list_unspents(config["ONLINE"], False, False)
+    """Return the list of spare colorable UTXOs, from the cached wallet state."""
+    unspents = config["WALLET_STATE"].get()["unspents"]
     return [u for u in unspents if u.utxo.colorable and not u.rgb_allocations]
 
 
@@ -139,4 +189,34 @@ def create_witness_utxos(config: Config, stats: dict, spare_utxos: list[Unspent]
         created = wallet.create_utxos(
             config["ONLINE"], False, utxo_num, config["UTXO_SIZE"], config["FEE_RATE"], False
         )
+        config["WALLET_STATE"].mark_stale()
     return created
+
+
+def operator_auth(view):
+    """Deny requests to the decorated view that lack the operator API key."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        auth = request.headers.get("X-Api-Key")
+        if auth != current_app.config["API_KEY_OPERATOR"]:
+            return jsonify({"error": "unauthorized"}), 401
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def wallet_required(view):
+    """Deny requests to the decorated view on nodes with no wallet (see ROLE).
+
+    Apply it after operator_auth, so the node role is not disclosed to
+    unauthenticated clients.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config["WALLET"] is None:
+            return jsonify({"error": "wallet not available on this node"}), 503
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -4,7 +4,7 @@ import string
 from hashlib import sha256
 
 import rgb_lib
-from rgb_lib import Assignment, Online, Wallet
+from rgb_lib import Assignment, Online, Unspent, Wallet
 
 from faucet_rgb.exceptions import ConfigurationError
 from faucet_rgb.settings import SUPPORTED_NETWORKS
@@ -92,7 +92,11 @@ def init_wallet(electrum_url: str, wallet_data: dict):
 
 def get_unspent_list(wallet: Wallet, online: Online):
     """Return a dict of the available unspents."""
-    unspents = wallet.list_unspents(online, False, False)
+    return format_unspents(wallet.list_unspents(online, False, False))
+
+
+def format_unspents(unspents: list[Unspent]):
+    """Return a dict of the provided unspents."""
     unspent_list = []
     for unspent in unspents:
         rgb_allocations_list = []
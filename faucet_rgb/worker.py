@@ -0,0 +1,37 @@
+"""Worker module, running the sending pipeline with no HTTP front-end."""
+
+import signal
+import sys
+import threading
+
+from . import create_app
+from .scheduler import scheduler
+from .settings import get_app
+
+
+def _get_worker_app():
+    """Return the app configured to run as worker."""
+    app = get_app(__package__)
+    app.config["ROLE"] = "worker"
+    return app
+
+
+def entrypoint():
+    """Poetry script entrypoint.
+
+    Initialize the wallet and start the scheduler jobs (batch donations and
+    random distribution), then wait until the process is terminated. Requests
+    are only read from the database, where HTTP front-end nodes (ROLE "web")
+    enqueue them.
+    """
+    app = create_app(_get_worker_app)
+    app.logger.info("worker %s started", app.config["NODE_ID"])
+
+    # exit cleanly on SIGTERM as well as on SIGINT (KeyboardInterrupt)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        threading.Event().wait()
+    except (KeyboardInterrupt, SystemExit):
+        app.logger.info("worker %s stopping", app.config["NODE_ID"])
+    finally:
+        scheduler.shutdown()
@@ -1,18 +1,23 @@
 """Tests for APIs."""
 
+import os
 import random
+import threading
 import time
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import rgb_lib
 
 from flask.app import Flask
 
-from faucet_rgb.database import Request, db, select_query
+from faucet_rgb.database import Lease, Request, acquire_lease, count_query, db, select_query
+from faucet_rgb.receive import REASON_MAP, DenyReason
 from faucet_rgb.scheduler import scheduler
 from faucet_rgb.settings import DistributionMode
+from faucet_rgb.tasks import SCHEDULER_LEASE
 from faucet_rgb.utils.wallet import get_sha256_hex
 from tests.utils import (
     BAD_HEADERS,
@@ -23,6 +28,7 @@ from tests.utils import (
     add_fake_request,
     check_receive_asset,
     create_and_blind,
+    create_test_app,
     generate,
     prepare_assets,
     prepare_user_wallets,
@@ -57,6 +63,7 @@ def _app_prep_random(app):
     now = datetime.now()
     req_win_open = now - timedelta(seconds=30)
     dist_mode = random_dist_mode(app.config, req_win_open, req_win_open + timedelta(minutes=1))
+    dist_mode["random_params"]["seed"] = "audit seed"
     app = prepare_assets(app, "group_1", dist_mode=dist_mode)
     return app
 
@@ -81,6 +88,115 @@ def test_control_assets(get_app):
     assert "name" in res.json["assets"][first_asset]
     assert "precision" in res.json["assets"][first_asset]
 
+    # a refresh can be waited for
+    scheduler.pause()
+    res_refresh = client.get(f"{api}?refresh=1", headers=OPERATOR_HEADERS)
+    assert res_refresh.json["assets"] == res.json["assets"]
+    assert res_refresh.json["refreshed_at"]
+
+    # assets are then served from the cached wallet state
+    loads = app.config["WALLET_STATE"].stats()["loads"]
+    res_cached = client.get(api, headers=OPERATOR_HEADERS)
+    assert res_cached.json == res_refresh.json
+    assert app.config["WALLET_STATE"].stats()["loads"] == loads
+
+
+def test_control_cache(get_app):
+    """Test /control/cache and /control/cache/refresh endpoints."""
+    app = get_app()
+    client = app.test_client()
+
+    # auth failure
+    for api in ("/control/cache", "/control/cache/refresh"):
+        res = client.get(api, headers=USER_HEADERS)
+        assert res.status_code == 401
+
+    # cache is populated on startup
+    resp = client.get("/control/cache", headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    stats = resp.json["assets"]
+    assert stats["size"] == 2
+    assert stats["hits"] == 0
+    assert stats["misses"] == 0
+    assert stats["populated_at"]
+    assert resp.json["wallet_state"]["max_age"] == app.config["WALLET_STATE_MAX_AGE"]
+
+    # asset data for requests is served from the cache
+    scheduler.pause()
+    user = prepare_user_wallets(app, 1)[0]
+    resp = receive_asset(client, user["xpub"], create_and_blind(app.config, user))
+    assert resp.status_code == 200
+    resp = client.get("/control/cache", headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.json["assets"]["hits"] == 1
+    assert resp.json["assets"]["misses"] == 0
+
+    # refresh reloads the cache from the wallet
+    resp = client.get("/control/cache/refresh", headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.json["assets"]["size"] == 2
+    assert resp.json["assets"]["hits"] == 1
+
+
+def test_control_leader(get_app):
+    """Test /control/leader endpoint."""
+    api = "/control/leader"
+    app = get_app()
+    client = app.test_client()
+    node_id = app.config["NODE_ID"]
+    holder_id = app.config["LEASE_HOLDER_ID"]
+    assert holder_id.startswith(f"{node_id}:")
+
+    # auth failure
+    res = client.get(api, headers=USER_HEADERS)
+    assert res.status_code == 401
+
+    # lease held by this process
+    with app.app_context():
+        assert acquire_lease(SCHEDULER_LEASE, holder_id, 60)
+    resp = client.get(api, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.json["node_id"] == node_id
+    assert resp.json["holder_id"] == holder_id
+    assert resp.json["leader"] is True
+    assert resp.json["lease"]["holder"] == holder_id
+    assert resp.json["lease"]["expired"] is False
+
+    # lease held by another node
+    with app.app_context():
+        db.session.execute(db.update(Lease).values(holder="other_node"))
+        db.session.commit()
+    resp = client.get(api, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.json["leader"] is False
+    assert resp.json["lease"]["holder"] == "other_node"
+
+
+def test_control_pipeline(get_app):
+    """Test /control/pipeline endpoint."""
+    api = "/control/pipeline"
+    app = get_app()
+    client = app.test_client()
+
+    # auth failure
+    res = client.get(api, headers=USER_HEADERS)
+    assert res.status_code == 401
+
+    # send a request, then check stage timings have been recorded
+    user = prepare_user_wallets(app, 1)[0]
+    resp = receive_asset(client, user["xpub"], create_and_witness(app.config, user))
+    assert resp.status_code == 200
+    wait_sched_process_pending(app)
+    resp = client.get(api, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    stages = resp.json["stages"]
+    stage_names = ("refresh", "claim", "prepare", "witness_utxos", "send_begin", "sign")
+    for stage in stage_names + ("send_end", "update"):
+        assert stages[stage]["count"] >= 1
+        assert stages[stage]["total"] >= 0
+    gauges = resp.json["gauges"]
+    assert gauges["faucet_utxo_pool_target"] >= app.config["SPARE_UTXO_NUM"]
+
 
 def test_control_delete(get_app):
     """Test /control/delete endpoint."""
@@ -384,10 +500,11 @@ def test_control_transfers(get_app):  # pylint: disable=too-many-statements
     check_receive_asset(app, user, None, 200)
     wait_sched_process_pending(app)
     resp = client.get(
-        api,
+        f"{api}?refresh=1",
         headers=OPERATOR_HEADERS,
     )
     assert resp.status_code == 200
+    assert resp.json["refreshed_at"] == app.config["WALLET_REFRESHER"].refreshed_at
     assert len(resp.json["transfers"]) == 1
     transfer = next(iter(resp.json["transfers"]))
     assert "amounts" in transfer
@@ -433,7 +550,7 @@ def test_control_transfers(get_app):  # pylint: disable=too-many-statements
     print("waiting for the transfer to expire...")
     time.sleep(2)
     resp = client.get(
-        f"{api}?status=WAITING_COUNTERPARTY",
+        f"{api}?status=WAITING_COUNTERPARTY&refresh=1",
         headers=OPERATOR_HEADERS,
     )
     assert resp.status_code == 200
@@ -453,6 +570,13 @@ def test_control_transfers(get_app):  # pylint: disable=too-many-statements
     assert resp.status_code == 200
     assert len(resp.json["transfers"]) == 1
 
+    # asset IDs are then taken from the cached wallet state
+    scheduler.pause()
+    loads = app.config["WALLET_STATE"].stats()["loads"]
+    resp = client.get(f"{api}?status=FAILED", headers=OPERATOR_HEADERS)
+    assert len(resp.json["transfers"]) == 1
+    assert app.config["WALLET_STATE"].stats()["loads"] == loads
+
 
 def test_control_unspents(get_app):
     """Test /control/unspents endpoint."""
@@ -562,6 +686,36 @@ def test_receive_asset(get_app):
     assert resp.json["error"] == "invalid asset group"
 
 
+def test_receive_asset_concurrent(get_app):
+    """Test concurrent /receive/asset requests from the same wallet and group."""
+    app: Flask = get_app()
+
+    # requests run on separate connections to a file-backed database
+    db_uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    assert db_uri.startswith("sqlite:///")
+    assert os.path.isfile(db_uri.removeprefix("sqlite:///"))
+
+    user = prepare_user_wallets(app, 1)[0]
+    invoices = [create_and_witness(app.config, user) for _ in range(5)]
+    barrier = threading.Barrier(len(invoices))
+
+    def _receive_asset(invoice):
+        client = app.test_client()
+        barrier.wait()  # send all requests at the same time
+        return receive_asset(client, user["xpub"], invoice)
+
+    # only one request is accepted, the others are denied as double requests
+    scheduler.pause()
+    with ThreadPoolExecutor(max_workers=len(invoices)) as executor:
+        responses = list(executor.map(_receive_asset, invoices))
+    assert sorted(r.status_code for r in responses) == [200] + [403] * (len(invoices) - 1)
+    for resp in responses:
+        if resp.status_code == 403:
+            assert resp.json["reason"] == REASON_MAP[DenyReason.ALREADY_REQUESTED.value]
+    with app.app_context():
+        assert db.session.scalar(count_query()) == 1
+
+
 def test_receive_asset_witness(get_app):
     """Test /receive/asset endpoint with a witness transfer."""
     app: Flask = get_app()
@@ -580,8 +734,13 @@ def test_receive_asset_witness(get_app):
     assert resp.status_code == 200
     with app.app_context():
         request = db.session.scalars(select_query(Request.invoice == invoice)).one()
+    invoice_data = rgb_lib.Invoice(invoice).invoice_data()
     assert request.status == 20
-    assert request.recipient_id == rgb_lib.Invoice(invoice).invoice_data().recipient_id
+    assert request.recipient_id == invoice_data.recipient_id
+    # invoice data needed for sending is stored on admission
+    assert request.recipient_type == "WITNESS"
+    assert request.transport_endpoints == invoice_data.transport_endpoints
+    assert request.expiration == invoice_data.expiration_timestamp
     wait_sched_process_pending(app)
     time.sleep(5)  # give the scheduler time to complete the send
     user["wallet"].refresh(user["online"], None, [], False)
@@ -639,6 +798,8 @@ def test_receive_asset_random(get_app):
     req_win_resp = req_win_datetimes(dist_resp, app.config["DATE_FORMAT"])
     assert req_win_resp["open"] == req_win_cfg["open"]
     assert req_win_resp["close"] == req_win_cfg["close"]
+    # the seed is not disclosed, as it would allow to predict the draw
+    assert "seed" not in dist_resp["random_params"]
 
 
 def test_receive_config(get_app):
@@ -684,6 +845,8 @@ def test_receive_config_random(get_app):
     req_win_resp = req_win_datetimes(dist_resp, app.config["DATE_FORMAT"])
     assert req_win_resp["open"] == req_win_cfg["open"]
     assert req_win_resp["close"] == req_win_cfg["close"]
+    # the seed is not disclosed, as it would allow to predict the draw
+    assert "seed" not in dist_resp["random_params"]
     assert "requests_left" in group
 
 
@@ -802,3 +965,36 @@ def test_reserve_topuprgb(get_app):  # pylint: disable=too-many-locals
     assert balance_3.settled == balance_2.settled + amount
     assert balance_3.future == balance_2.future
     assert balance_3.spendable == balance_2.spendable + amount
+
+
+def test_web_role(get_app):
+    """Test a web-only node serves requests without a wallet."""
+    app = get_app()
+    user = prepare_user_wallets(app, 1)[0]
+    scheduler.pause()
+
+    # web-only node sharing the same database
+    config = app.config.copy()
+    config["ROLE"] = "web"
+    web_app = create_test_app(config=config)
+    assert web_app.config["WALLET"] is None
+    client = web_app.test_client()
+
+    # endpoints that need the wallet are not available
+    for api in ("/control/assets", "/control/unspents", "/reserve/top_up_btc"):
+        resp = client.get(api, headers=OPERATOR_HEADERS)
+        assert resp.status_code == 503
+        # authentication is checked first, not to disclose the node role
+        resp = client.get(api, headers=USER_HEADERS)
+        assert resp.status_code == 401
+
+    # asset metadata is loaded from the database
+    resp = client.get("/control/cache/refresh", headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.json["assets"]["size"] == 2
+
+    # requests are enqueued for the worker
+    resp = receive_asset(client, user["xpub"], create_and_blind(app.config, user))
+    assert resp.status_code == 200
+    with web_app.app_context():
+        assert db.session.scalar(count_query(Request.status == 20)) == 1
@@ -0,0 +1,54 @@
+"""Tests for the bulk request API."""
+
+import json
+
+from flask.app import Flask
+
+from faucet_rgb.database import Request, count_query, db
+from faucet_rgb.receive import REASON_MAP, DenyReason
+from faucet_rgb.scheduler import scheduler
+from faucet_rgb.utils.wallet import get_sha256_hex
+from tests.utils import OPERATOR_HEADERS, USER_HEADERS, create_and_blind, prepare_user_wallets
+
+
+def test_receive_asset_bulk(get_app):
+    """Test /receive/asset/bulk endpoint."""
+    api = "/receive/asset/bulk"
+    app: Flask = get_app()
+    client = app.test_client()
+
+    scheduler.pause()
+    users = prepare_user_wallets(app, 3)
+    items = [
+        {"wallet_id": get_sha256_hex(user["xpub"]), "invoice": create_and_blind(app.config, user)}
+        for user in users
+    ]
+
+    # auth failure
+    res = client.post(api, json=items, headers=USER_HEADERS)
+    assert res.status_code == 401
+    # malformed body (not a list)
+    res = client.post(api, json=items[0], headers=OPERATOR_HEADERS)
+    assert res.status_code == 400
+
+    # JSON array, with a double request and invalid items
+    body = items[:2] + [items[0], {"wallet_id": users[2]["xpub"], "invoice": "invalid"}, "bad"]
+    resp = client.post(api, json=body, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    results = resp.json["results"]
+    assert [r["code"] for r in results] == [200, 200, 403, 403, 400]
+    assert all("asset" in r for r in results[:2])
+    assert results[2]["reason"] == REASON_MAP[DenyReason.ALREADY_REQUESTED.value]
+    with app.app_context():
+        assert db.session.scalar(count_query(Request.status == 20)) == 2
+
+    # NDJSON stream, with a request already placed by a previous call
+    resp = client.post(
+        api,
+        data="\n".join(json.dumps(item) for item in items[1:]),
+        headers={**OPERATOR_HEADERS, "Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 200
+    assert [r["code"] for r in resp.json["results"]] == [403, 200]
+    with app.app_context():
+        assert db.session.scalar(count_query(Request.status == 20)) == 3
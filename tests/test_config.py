@@ -1,9 +1,13 @@
 """Tests for APIs."""
 
+import socket
 from datetime import datetime, timedelta
 
+import pytest
+
 from faucet_rgb import exceptions
 from faucet_rgb.database import count_query, db, select_query
+from faucet_rgb.settings import DistributionMode
 from tests.utils import (
     check_receive_asset,
     prepare_assets,
@@ -70,6 +74,30 @@ def _app_prep_cfg_random_bad_req_win(app):
     return app
 
 
+def _app_prep_cfg_random_bad_seed(app):
+    """Prepare app with random distribution mode but bad seed."""
+    now = datetime.now()
+    dist_mode = random_dist_mode(app.config, now, now + timedelta(minutes=1))
+    dist_mode["random_params"]["seed"] = 1.5
+    app = prepare_assets(app, "group_1", dist_mode=dist_mode)
+    return app
+
+
+def _app_prep_cfg_no_node_id(app):
+    """Prepare app with no node ID."""
+    app = prepare_assets(app, "group_1")
+    app.config["NODE_ID"] = None
+    return app
+
+
+def _app_prep_cfg_random(app):
+    """Prepare app with random distribution mode."""
+    now = datetime.now()
+    dist_mode = random_dist_mode(app.config, now, now + timedelta(minutes=1))
+    app = prepare_assets(app, "group_1", dist_mode=dist_mode)
+    return app
+
+
 def _app_prep_0conf(app):
     """Prepare app for the first launch."""
     app = prepare_assets(app, "group_1")
@@ -107,6 +135,25 @@ def test_0_conf(get_app):
     refresh_and_check_settled(client, app.config, asset_id)
 
 
+def test_cfg_asset_groups(get_app):
+    """Test asset group configuration is compiled on startup."""
+    app = get_app(_app_prep_cfg_random)
+    asset_groups = app.config["ASSET_GROUPS"]
+    assert list(asset_groups) == ["group_1"]
+    group = asset_groups["group_1"]
+    assert group.mode == DistributionMode.RANDOM
+    assert group.request_window_open < group.request_window_close
+    assert group.distribution == app.config["ASSETS"]["group_1"]["distribution"]
+    for asset_conf in app.config["ASSETS"]["group_1"]["assets"]:
+        asset = asset_groups.get_asset(asset_conf["asset_id"])
+        assert asset.amount == asset_conf["amount"]
+        assert asset.group_name == "group_1"
+    assert asset_groups.get_asset("inexistent") is None
+    # compiled groups are read-only
+    with pytest.raises(AttributeError):
+        group.label = "changed"
+
+
 def test_cfg_no_dist(get_app):
     """Test configuration with missing distribution key."""
     try:
@@ -161,6 +208,22 @@ def test_cfg_random_bad_req_win(get_app):
         assert "not after open" in err.errors[0]
 
 
+def test_cfg_random_bad_seed(get_app):
+    """Test configuration for random distribution mode with bad seed."""
+    try:
+        get_app(_app_prep_cfg_random_bad_seed)
+    except exceptions.ConfigurationError as err:
+        assert len(err.errors) == 1
+        assert "invalid seed" in err.errors[0]
+
+
+def test_cfg_no_node_id(get_app):
+    """Test configuration with no node ID, defaulting to the host name."""
+    app = get_app(_app_prep_cfg_no_node_id)
+    assert app.config["NODE_ID"] == socket.gethostname()
+    assert app.config["LEASE_HOLDER_ID"].startswith(f"{socket.gethostname()}:")
+
+
 def test_cfg_missing_asset(get_app):
     """Test configuration with missing asset."""
     try:
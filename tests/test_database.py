@@ -0,0 +1,261 @@
+"""Tests for the database."""
+
+import io
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from faucet_rgb.database import (
+    Batch,
+    Lease,
+    Request,
+    acquire_lease,
+    claim_requests,
+    count_query,
+    db,
+    insert_requests,
+    pending_query,
+    release_lease,
+    select_query,
+    serve_batch,
+    update_query,
+)
+
+
+def _query_plan(stmt):
+    """Return the SQLite query plan for the provided statement as a single string."""
+    sql = stmt.compile(db.engine, compile_kwargs={"literal_binds": True})
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_request_indexes(get_app):
+    """Test hot request queries are backed by indexes instead of full scans."""
+    app = get_app()
+
+    with app.app_context():
+        # per-wallet eligibility check
+        plan = _query_plan(
+            count_query(Request.wallet_id == "wallet", Request.asset_group == "group_1")
+        )
+        assert "ix_request_wallet_id_asset_group" in plan
+
+        # scheduler queue scan, for a single asset
+        plan = _query_plan(pending_query(Request.asset_id == "asset"))
+        assert "ix_request_status_asset_id_timestamp" in plan
+        assert "TEMP B-TREE" not in plan
+
+        # oldest pending request
+        plan = _query_plan(pending_query().limit(1))
+        assert "ix_request_status_timestamp" in plan
+        assert "TEMP B-TREE" not in plan
+
+        # request listing, by time range
+        plan = _query_plan(
+            select_query(Request.timestamp >= 1, Request.timestamp <= 2).order_by(Request.idx)
+        )
+        assert "ix_request_timestamp" in plan
+
+
+def test_sqlite_pragmas(get_app):
+    """Test configured SQLite pragmas are applied to database connections."""
+    app = get_app()
+
+    with app.app_context():
+        journal_mode = db.session.execute(text("PRAGMA journal_mode")).scalar()
+        assert journal_mode == "wal"
+        synchronous = db.session.execute(text("PRAGMA synchronous")).scalar()
+        assert synchronous == 1  # NORMAL
+        busy_timeout = db.session.execute(text("PRAGMA busy_timeout")).scalar()
+        assert busy_timeout == app.config["DATABASE_SQLITE_PRAGMAS"]["busy_timeout"]
+        assert db.engine.pool.size() == app.config["DATABASE_POOL_SIZE"]
+
+
+def _upgrade_revisions(ctx):
+    """Run all migration upgrades, oldest first, in the provided context."""
+    for revision in reversed(list(ScriptDirectory("migrations").walk_revisions())):
+        with Operations.context(ctx):
+            revision.module.upgrade()
+
+
+@pytest.mark.parametrize("dialect_name", ["sqlite", "postgresql"])
+def test_dialect_compat(dialect_name):
+    """Test migrations and request claiming statements are portable across dialects.
+
+    Migrations need to create the claim column, the unique per-wallet request
+    index, the lease table and the request to batch foreign key.
+    """
+    if dialect_name == "sqlite":
+        # batch migrations need a live database
+        engine = create_engine("sqlite://")
+        with engine.begin() as conn:
+            _upgrade_revisions(MigrationContext.configure(conn))
+            inspector = inspect(conn)
+            columns = {c["name"] for c in inspector.get_columns("request")}
+            indexes = {i["name"]: i for i in inspector.get_indexes("request")}
+            foreign_keys = inspector.get_foreign_keys("request")
+            tables = inspector.get_table_names()
+        assert columns == set(Request.__table__.columns.keys())
+        assert indexes["ix_request_wallet_id_asset_group"]["unique"]
+        assert indexes["ix_request_wallet_id_asset_group"]["column_names"] == [
+            "wallet_id",
+            "asset_group",
+        ]
+        assert "lease" in tables
+        assert [(fk["constrained_columns"], fk["referred_table"]) for fk in foreign_keys] == [
+            (["batch_idx"], "batch")
+        ]
+    else:
+        # PostgreSQL migrations are checked on the generated SQL
+        buf = io.StringIO()
+        ctx = MigrationContext.configure(
+            dialect_name=dialect_name, opts={"as_sql": True, "output_buffer": buf}
+        )
+        _upgrade_revisions(ctx)
+        sql = buf.getvalue()
+        assert "ALTER TABLE request ADD COLUMN claimed_by VARCHAR(256);" in sql
+        assert (
+            "CREATE UNIQUE INDEX ix_request_wallet_id_asset_group "
+            "ON request (wallet_id, asset_group);"
+        ) in sql
+        assert "CREATE TABLE lease (" in sql
+        assert (
+            "ALTER TABLE request ADD CONSTRAINT fk_request_batch_idx_batch "
+            "FOREIGN KEY(batch_idx) REFERENCES batch (idx);"
+        ) in sql
+
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}[dialect_name].dialect()
+    claim_select = str(
+        select_query(Request.status == 20)
+        .with_only_columns(Request.idx)
+        .with_for_update(skip_locked=True)
+        .compile(dialect=dialect)
+    )
+    claim_update = str(
+        update_query(Request.idx.in_([1, 2]), Request.status == 20)
+        .values(status=30, claimed_by="node")
+        .returning(Request.idx)
+        .compile(dialect=dialect)
+    )
+    if dialect_name == "postgresql":
+        assert claim_select.endswith("FOR UPDATE SKIP LOCKED")
+        assert claim_update.endswith("RETURNING request.idx")
+    else:
+        assert "FOR UPDATE" not in claim_select
+        assert claim_update.endswith("RETURNING idx")
+
+
+def test_claim_requests(get_app):
+    """Test pending requests are claimed by a single node."""
+    app = get_app()
+
+    with app.app_context():
+        for num in range(3):
+            db.session.add(
+                Request(f"wallet_{num}", "recipient", "invoice", "group_1", "asset", 1, status=20)
+            )
+        db.session.add(
+            Request("wallet_3", "recipient", "invoice", "group_1", "asset", 1, status=25)
+        )
+        db.session.commit()
+        stmt = select_query(Request.status == 20).order_by(Request.idx)
+
+        claimed = claim_requests(stmt, "node_1")
+        assert len(claimed) == 3
+        assert all(r.status == 30 and r.claimed_by == "node_1" for r in claimed)
+        # requests already claimed cannot be claimed again
+        assert not claim_requests(stmt, "node_2")
+
+        # a claim only moves requests that are still pending
+        db.session.execute(update_query(Request.status == 30).values(status=20))
+        db.session.commit()
+        idx = claimed[0].idx
+        db.session.execute(update_query(Request.idx == idx).values(status=40))
+        claimed = claim_requests(select_query(Request.status.in_([20, 40])), "node_2")
+        assert idx not in [r.idx for r in claimed]
+        assert len(claimed) == 2
+        assert db.session.scalar(count_query(Request.claimed_by == "node_2")) == 2
+
+
+def test_insert_requests(get_app):
+    """Test requests are inserted with a single statement, skipping double ones."""
+    app = get_app()
+
+    with app.app_context():
+        db.session.add(Request("wallet_0", "recipient", "invoice", "group_1", "asset", 1))
+        db.session.commit()
+
+        reqs = [
+            Request(f"wallet_{num}", "recipient", "invoice", "group_1", "asset", 1, status=20)
+            for num in range(3)
+        ]
+        inserted = insert_requests(reqs)
+        assert inserted == {("wallet_1", "group_1"), ("wallet_2", "group_1")}
+        assert db.session.scalar(count_query(Request.status == 20)) == 2
+        assert db.session.scalar(count_query()) == 3
+
+
+def test_acquire_lease(get_app):
+    """Test a lease is held by a single node until it expires."""
+    app = get_app()
+
+    with app.app_context():
+        assert acquire_lease("test", "node_1", 60)
+        acquired_at = db.session.get(Lease, "test").acquired_at
+        # the holder renews the lease, other nodes cannot take it
+        assert acquire_lease("test", "node_1", 60)
+        assert not acquire_lease("test", "node_2", 60)
+        lease = db.session.get(Lease, "test")
+        assert lease.holder == "node_1"
+        assert lease.acquired_at == acquired_at
+
+        # expired leases are taken over
+        db.session.execute(db.update(Lease).values(expires_at=acquired_at - 1))
+        db.session.commit()
+        assert acquire_lease("test", "node_2", 60)
+        assert not acquire_lease("test", "node_1", 60)
+        assert db.session.get(Lease, "test").holder == "node_2"
+
+        # released leases are taken over right away, only by their holder
+        release_lease("test", "node_1")
+        assert not acquire_lease("test", "node_1", 60)
+        release_lease("test", "node_2")
+        assert acquire_lease("test", "node_1", 60)
+
+
+@pytest.mark.parametrize("batch_size", [10, 100, 1000])
+def test_serve_batch(get_app, batch_size):
+    """Test a batch is served with a single UPDATE, whatever its size."""
+    app = get_app()
+
+    with app.app_context():
+        batch = Batch("node_1", 1, {"recipients": batch_size, "witnesses": 0})
+        db.session.add(batch)
+        db.session.flush()
+        db.session.add_all(
+            Request(f"wallet_{num}", "recipient", "invoice", "group_1", "asset", 1, status=30)
+            for num in range(batch_size)
+        )
+        db.session.flush()
+        db.session.execute(update_query().values(batch_idx=batch.idx))
+        batch.set_broadcast("txid")
+        db.session.commit()
+
+        statements = []
+
+        def _record(_conn, _cursor, statement, *_):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", _record)
+        try:
+            served = serve_batch(batch.idx)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", _record)
+
+        assert served == batch_size
+        assert len([s for s in statements if s.startswith("UPDATE request")]) == 1
+        assert db.session.scalar(count_query(Request.status == 40)) == batch_size
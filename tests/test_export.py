@@ -0,0 +1,123 @@
+"""Tests for the request listing, export and statistics APIs."""
+
+import csv
+import io
+import json
+
+from flask.app import Flask
+
+from faucet_rgb.database import Batch, Request, db, update_query
+from faucet_rgb.scheduler import scheduler
+from tests.utils import OPERATOR_HEADERS, prepare_assets
+
+
+def _app_prep_stats_cache(app):
+    """Prepare app with cached request statistics."""
+    app = prepare_assets(app, "group_1")
+    app.config["STATS_CACHE_MAX_AGE"] = 3600
+    return app
+
+
+def _add_requests(app: Flask, count: int):
+    """Add requests with increasing timestamps, odd ones served by a batch."""
+    with app.app_context():
+        batch = Batch("node_1", 1, {"recipients": count // 2, "witnesses": 0})
+        db.session.add(batch)
+        db.session.flush()
+        batch.set_broadcast("txid")
+        for num in range(count):
+            req = Request(f"wallet_{num}", "recipient", "invoice", "group_1", "asset", 1, status=20)
+            req.timestamp = 1000 + num
+            db.session.add(req)
+        db.session.flush()
+        db.session.execute(
+            update_query(Request.idx % 2 == 1).values(status=40, batch_idx=batch.idx)
+        )
+        db.session.commit()
+
+
+def test_control_requests_pages(get_app):
+    """Test /control/requests keyset pagination and time range filters."""
+    api = "/control/requests"
+    app: Flask = get_app()
+    client = app.test_client()
+    scheduler.pause()
+    _add_requests(app, 250)
+
+    # pages follow each other with no gaps nor repetitions
+    idxs, after_idx = [], None
+    while True:
+        query = {"status": 40} if after_idx is None else {"status": 40, "after_idx": after_idx}
+        resp = client.get(api, query_string=query, headers=OPERATOR_HEADERS)
+        assert resp.status_code == 200
+        assert len(resp.json["requests"]) <= 100
+        idxs += [req["idx"] for req in resp.json["requests"]]
+        after_idx = resp.json["next_after_idx"]
+        if after_idx is None:
+            break
+    assert len(idxs) == 125
+    assert idxs == sorted(set(idxs), reverse=True)
+
+    # time range, inclusive
+    query = {"from_timestamp": 1010, "to_timestamp": 1019}
+    resp = client.get(api, query_string=query, headers=OPERATOR_HEADERS)
+    assert [req["timestamp"] for req in resp.json["requests"]] == list(range(1019, 1009, -1))
+
+    # bad parameters
+    for query in ({"after_idx": "last"}, {"from_timestamp": "today"}, {"format": "xml"}):
+        resp = client.get(api, query_string=query, headers=OPERATOR_HEADERS)
+        assert resp.status_code == 400
+
+
+def test_control_requests_export(get_app):
+    """Test /control/requests streaming export in NDJSON and CSV formats."""
+    api = "/control/requests"
+    app: Flask = get_app()
+    client = app.test_client()
+    scheduler.pause()
+    _add_requests(app, 2500)
+
+    resp = client.get(api, query_string={"format": "ndjson"}, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    reqs = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert len(reqs) == 1250
+    assert all(req["status"] == 20 and req["batch"] is None for req in reqs)
+
+    query = {"format": "csv", "txid": "txid", "to_timestamp": 1099}
+    resp = client.get(api, query_string=query, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/csv"
+    rows = list(csv.DictReader(io.StringIO(resp.data.decode())))
+    assert len(rows) == 50
+    assert all(row["status"] == "40" and row["txid"] == "txid" for row in rows)
+
+
+def test_control_stats(get_app):
+    """Test /control/stats endpoint, with cached statistics."""
+    api = "/control/stats"
+    app: Flask = get_app(_app_prep_stats_cache)
+    client = app.test_client()
+    scheduler.pause()
+    _add_requests(app, 20)
+
+    resp = client.get(api, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.json["totals"]["pending"] == 10
+    assert resp.json["totals"]["served"] == 10
+    assert {"asset_group": "group_1", "asset_id": "asset", "status": "served", "count": 10} in (
+        resp.json["counts"]
+    )
+    # served requests are counted in the hour their batch has been broadcast
+    assert len(resp.json["served_per_hour"]) == 1
+    assert resp.json["served_per_hour"][0]["count"] == 10
+
+    # cached statistics are served until refreshed
+    with app.app_context():
+        db.session.execute(update_query(Request.status == 20).values(status=45))
+        db.session.commit()
+    resp = client.get(api, headers=OPERATOR_HEADERS)
+    assert resp.json["totals"]["pending"] == 10
+    resp = client.get(api, query_string={"refresh": 1}, headers=OPERATOR_HEADERS)
+    assert resp.json["totals"]["pending"] == 0
+    assert resp.json["totals"]["unmet"] == 10
@@ -0,0 +1,70 @@
+"""Tests for metrics."""
+
+from flask.app import Flask
+
+from faucet_rgb.metrics import Metrics
+from faucet_rgb.scheduler import scheduler
+from tests.utils import OPERATOR_HEADERS, USER_HEADERS
+
+
+def test_metrics_render():
+    """Test metrics are rendered in the Prometheus text format."""
+    metrics = Metrics()
+    for value in (0.002, 0.3, 500):
+        metrics.observe("faucet_job_duration_seconds", value, job="batch_donation")
+    metrics.inc("faucet_http_requests_total", endpoint="receive.config", status=200)
+    metrics.inc("faucet_http_requests_total", endpoint="receive.config", status=200)
+
+    gauges = {"faucet_requests": ("requests", {(("status", 'a"b'),): 3})}
+    lines = metrics.render(gauges).splitlines()
+    assert "# TYPE faucet_job_duration_seconds histogram" in lines
+    # buckets are cumulative
+    assert 'faucet_job_duration_seconds_bucket{job="batch_donation",le="0.001"} 0' in lines
+    assert 'faucet_job_duration_seconds_bucket{job="batch_donation",le="0.005"} 1' in lines
+    assert 'faucet_job_duration_seconds_bucket{job="batch_donation",le="120"} 2' in lines
+    assert 'faucet_job_duration_seconds_bucket{job="batch_donation",le="+Inf"} 3' in lines
+    assert 'faucet_job_duration_seconds_count{job="batch_donation"} 3' in lines
+    assert 'faucet_http_requests_total{endpoint="receive.config",status="200"} 2' in lines
+    # label values are escaped
+    assert 'faucet_requests{status="a\\"b"} 3' in lines
+
+
+def test_metrics_endpoint(get_app):
+    """Test /metrics endpoint."""
+    api = "/metrics"
+    app: Flask = get_app()
+    client = app.test_client()
+    scheduler.pause()
+
+    # auth failure
+    resp = client.get(api, headers=USER_HEADERS)
+    assert resp.status_code == 401
+
+    client.get("/control/requests", headers=OPERATOR_HEADERS)
+    resp = client.get(api, headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    lines = resp.data.decode().splitlines()
+    assert 'faucet_http_request_duration_seconds_count{endpoint="control.list_requests"} 1' in (
+        lines
+    )
+    assert 'faucet_http_requests_total{endpoint="exporter.metrics",status="401"} 1' in lines
+    assert any(
+        line.startswith('faucet_http_request_db_queries_count{endpoint="control.list_requests"}')
+        for line in lines
+    )
+    assert 'faucet_requests{status="pending"} 0' in lines
+    # all queries are timed, also outside HTTP requests
+    assert any(line.startswith("faucet_db_query_duration_seconds_count ") for line in lines)
+
+    # streamed responses are recorded once complete, with the queries they ran
+    db_queries_sum = 'faucet_http_request_db_queries_sum{endpoint="control.list_requests"}'
+    db_queries = next(line for line in lines if line.startswith(db_queries_sum))
+    resp = client.get("/control/requests?format=ndjson", headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    lines = client.get(api, headers=OPERATOR_HEADERS).data.decode().splitlines()
+    assert 'faucet_http_request_duration_seconds_count{endpoint="control.list_requests"} 2' in (
+        lines
+    )
+    streamed_db_queries = next(line for line in lines if line.startswith(db_queries_sum))
+    assert float(streamed_db_queries.split()[-1]) > float(db_queries.split()[-1])
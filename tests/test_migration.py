@@ -7,8 +7,9 @@ import os
 import shutil
 import time
 
-from faucet_rgb.database import Request, db, select_query
+from faucet_rgb.database import Request, db, delete_query, select_query
 from faucet_rgb.scheduler import scheduler
+from faucet_rgb.utils.wallet import get_sha256_hex
 from tests.utils import (
     add_fake_request,
     check_receive_asset,
@@ -181,6 +182,16 @@ def test_migration(get_app):  # pylint: disable=too-many-statements
     # second request for same migration group not allowed
     check_requests_left(app, users[2]["xpub"], {"group_1": 0, "group_2": 1, "group_dummy": 0})
     check_receive_asset(app, users[2], "group_1", 403)
+    # group_2 request that cannot be added > migration still allowed afterwards
+    wallet_id_2 = get_sha256_hex(users[2]["xpub"])
+    with app.app_context():
+        db.session.add(Request(wallet_id_2, "recipient", "invoice", "group_2", None, None))
+        db.session.commit()
+    check_receive_asset(app, users[2], "group_2", 403)
+    assert wallet_id_2 in app.config["ASSET_MIGRATION_CACHE"]["group_2"]
+    with app.app_context():
+        db.session.execute(delete_query(Request.wallet_id == wallet_id_2, Request.status == 10))
+        db.session.commit()
     # group_2 specified > send migrated asset
     check_receive_asset(app, users[2], "group_2", 200, new_group_2_asset_ids)
     # second request for same migration group not allowed
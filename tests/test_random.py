@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from faucet_rgb.database import Request, count_query, db
 from faucet_rgb.receive import REASON_MAP
 from faucet_rgb.settings import DistributionMode
+from faucet_rgb.tasks import draw_winners, draw_winners_streaming
 from faucet_rgb.utils.wallet import get_sha256_hex
 from tests.utils import (
     OPERATOR_HEADERS,
@@ -259,3 +260,34 @@ def test_random_multiple_assets(get_app):  # pylint: disable=too-many-locals
             result["unmet"] += 1
     assert result["served"] == asset_balance * 2
     assert result["unmet"] == extra_requests * 2
+
+
+def test_draw_winners():
+    """Test the draw of winners is reproducible from its seed."""
+    idxs = list(range(1, 1001))
+    winners = draw_winners(idxs, 10, "seed:asset")
+    assert len(winners) == 10
+    assert len(set(winners)) == 10
+    assert set(winners) <= set(idxs)
+    # same seed and requests, whatever their order, draw the same winners
+    assert draw_winners(list(reversed(idxs)), 10, "seed:asset") == winners
+    assert draw_winners(idxs, 10, "other:asset") != winners
+    # everyone wins if there are enough assets, nobody does with no balance
+    assert draw_winners(idxs[:5], 10, "seed:asset") == idxs[:5]
+    assert not draw_winners(idxs, 0, "seed:asset")
+    assert not draw_winners(idxs, -1, "seed:asset")
+
+
+def test_draw_winners_streaming():
+    """Test the streamed draw of winners is reproducible from its seed."""
+    winners = draw_winners_streaming(iter(range(1, 100001)), 10, "seed:asset")
+    assert len(winners) == 10
+    assert len(set(winners)) == 10
+    assert all(1 <= w <= 100000 for w in winners)
+    assert draw_winners_streaming(iter(range(1, 100001)), 10, "seed:asset") == winners
+    assert draw_winners_streaming(iter(range(1, 100001)), 10, "other:asset") != winners
+    # everyone wins if there are enough assets, nobody does with no balance
+    assert draw_winners_streaming(iter(range(1, 6)), 10, "seed:asset") == [1, 2, 3, 4, 5]
+    assert not draw_winners_streaming(iter(range(1, 6)), 0, "seed:asset")
+    # requests loaded in memory draw the same winners as streamed ones
+    assert draw_winners(list(range(100000, 0, -1)), 10, "seed:asset") == winners
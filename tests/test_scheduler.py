@@ -2,13 +2,17 @@
 
 import time
 
+import rgb_lib
+
 from faucet_rgb import scheduler
-from faucet_rgb.database import Request, count_query, db, select_query
-from faucet_rgb.scheduler import send_next_batch
-from faucet_rgb.utils import get_spare_available, get_spare_utxos
+from faucet_rgb.database import Batch, Request, claim_requests, count_query, db, select_query
+from faucet_rgb.scheduler import resume_batches, send_batches, send_next_batch
+from faucet_rgb.utils import get_recipient, get_spare_available, get_spare_utxos
 from faucet_rgb.utils.wallet import get_sha256_hex
 from tests.utils import (
+    OPERATOR_HEADERS,
     USER_HEADERS,
+    create_and_blind,
     issue_single_asset_with_supply,
     prepare_assets,
     prepare_user_wallets,
@@ -33,6 +37,23 @@ def _app_prep_create_witness_utxos(app):
     return app
 
 
+def _app_prep_max_batch_recipients(app):
+    """Prepare app to test batch splitting."""
+    app = prepare_assets(app, "group_1")
+    app.config["MAX_BATCH_RECIPIENTS"] = 2
+    app.config["SINGLE_ASSET_SEND"] = False
+    return app
+
+
+def _app_prep_event_driven(app):
+    """Prepare app to test sends are triggered by requests, not by the interval."""
+    app = prepare_assets(app, "group_1")
+    app.config["MIN_REQUESTS"] = 2
+    app.config["SCHEDULER_INTERVAL"] = 600
+    app.config["SINGLE_ASSET_SEND"] = False
+    return app
+
+
 def _issue_single_asset_1000(app):
     return issue_single_asset_with_supply(app, 1000)
 
@@ -151,3 +172,164 @@ def test_single_asset_false(get_app):
     with app.app_context():
         assert db.session.scalar(count_query()) == 2
         assert all(r.status == 40 for r in db.session.scalars(select_query()).all())
+
+
+def test_max_batch_recipients(get_app):
+    """Test pending requests are split into batches of capped size."""
+    app = get_app(_app_prep_max_batch_recipients)
+    client = app.test_client()
+
+    scheduler.pause()
+
+    users = prepare_user_wallets(app, 3)
+    for user in users:
+        invoice = create_and_witness(app.config, user)
+        resp = receive_asset(client, user["xpub"], invoice)
+        assert resp.status_code == 200
+
+    # manually trigger sending, 3 requests need 2 batches
+    results = send_batches(get_spare_utxos(app.config))
+    assert results == [True, True]
+
+    # check all requests have been sent
+    with app.app_context():
+        assert db.session.scalar(count_query()) == 3
+        assert all(r.status == 40 for r in db.session.scalars(select_query()).all())
+        batches = db.session.scalars(db.select(Batch).order_by(Batch.idx)).all()
+    assert [b.recipients for b in batches] == [2, 1]
+    assert all(b.txid and b.broadcast_at and b.fee_rate for b in batches)
+
+    # check served requests are linked to the TXID of their batch
+    resp = client.get(f"/control/requests?txid={batches[0].txid}", headers=OPERATOR_HEADERS)
+    assert resp.status_code == 200
+    assert len(resp.json["requests"]) == 2
+    for req in resp.json["requests"]:
+        assert req["batch"]["idx"] == batches[0].idx
+        assert req["batch"]["txid"] == batches[0].txid
+        assert req["batch"]["status"] == 30
+
+
+def test_expired_requests(get_app):
+    """Test pending requests with an expired invoice are set as unmet, not sent."""
+    app = get_app()
+    client = app.test_client()
+
+    scheduler.pause()
+
+    users = prepare_user_wallets(app, 2)
+    for user in users:
+        invoice = create_and_witness(app.config, user)
+        resp = receive_asset(client, user["xpub"], invoice)
+        assert resp.status_code == 200
+    with app.app_context():
+        expired_req = db.session.scalars(select_query().order_by(Request.idx)).first()
+        expired_req.expiration = int(time.time()) - 1
+        db.session.commit()
+        expired_idx = expired_req.idx
+
+    # manually trigger sending, only the request with a valid invoice is sent
+    results = send_batches(get_spare_utxos(app.config))
+    assert results == [True]
+    with app.app_context():
+        statuses = {r.idx: r.status for r in db.session.scalars(select_query()).all()}
+    assert statuses.pop(expired_idx) == 45
+    assert list(statuses.values()) == [40]
+
+
+def test_event_driven_send(get_app):
+    """Test reaching MIN_REQUESTS triggers a send without waiting for the interval."""
+    app = get_app(_app_prep_event_driven)
+    client = app.test_client()
+
+    users = prepare_user_wallets(app, 2)
+    for user in users:
+        invoice = create_and_witness(app.config, user)
+        resp = receive_asset(client, user["xpub"], invoice)
+        assert resp.status_code == 200
+
+    # requests are sent well before the next scheduler interval
+    with app.app_context():
+        deadline = time.time() + 60
+        while db.session.scalar(count_query(Request.status == 40)) != 2:
+            assert time.time() < deadline, "requests not sent"
+            time.sleep(1)
+
+
+def test_resume_batch(get_app):
+    """Test a batch interrupted after being prepared is taken over and resumed."""
+    app = get_app()
+    client = app.test_client()
+
+    scheduler.pause()
+
+    user = prepare_user_wallets(app, 1)[0]
+    resp = receive_asset(client, user["xpub"], create_and_blind(app.config, user))
+    assert resp.status_code == 200
+
+    # build a batch then stop, as if the node died before signing it
+    cfg = app.config
+    with app.app_context():
+        req = claim_requests(select_query(Request.status == 20), "crashed_node")[0]
+        recipient_map = {req.asset_id: [get_recipient(req.invoice, req.amount, cfg)]}
+        unsigned_psbt = cfg["WALLET"].send_begin(
+            cfg["ONLINE"], recipient_map, True, cfg["FEE_RATE"], cfg["MIN_CONFIRMATIONS"]
+        )
+        batch = Batch("crashed_node", cfg["FEE_RATE"], {"recipients": 1, "witnesses": 0})
+        batch.set_status(10, unsigned_psbt)
+        db.session.add(batch)
+        db.session.flush()
+        req.batch_idx = batch.idx
+        db.session.commit()
+
+        # resume from the prepared phase, taking the batch over
+        assert resume_batches(cfg) == [True]
+        batch = db.session.scalars(db.select(Batch)).one()
+        assert batch.status == 30
+        assert batch.node_id == cfg["NODE_ID"]
+        assert batch.txid is not None
+        req = db.session.scalars(select_query()).one()
+        assert req.status == 40
+        assert req.batch_idx == batch.idx
+        assert req.claimed_by == cfg["NODE_ID"]
+
+
+def test_resume_preparing_batch(get_app):
+    """Test a batch interrupted while being prepared is failed, its requests released."""
+    app = get_app()
+    client = app.test_client()
+
+    scheduler.pause()
+
+    user = prepare_user_wallets(app, 1)[0]
+    resp = receive_asset(client, user["xpub"], create_and_blind(app.config, user))
+    assert resp.status_code == 200
+
+    # build a transaction then stop, as if the node died before persisting it
+    cfg = app.config
+    with app.app_context():
+        req = claim_requests(select_query(Request.status == 20), cfg["NODE_ID"])[0]
+        batch = Batch(cfg["NODE_ID"], cfg["FEE_RATE"], {"recipients": 1, "witnesses": 0})
+        db.session.add(batch)
+        db.session.flush()
+        req.batch_idx = batch.idx
+        db.session.commit()
+        recipient_map = {req.asset_id: [get_recipient(req.invoice, req.amount, cfg)]}
+        cfg["WALLET"].send_begin(
+            cfg["ONLINE"], recipient_map, True, cfg["FEE_RATE"], cfg["MIN_CONFIRMATIONS"]
+        )
+
+        # no batch is sent while this one has not been broadcast
+        assert not send_batches(get_spare_utxos(cfg))
+
+        # the batch is failed on resume, along with its rgb-lib transfer
+        assert resume_batches(cfg) == [False]
+        assert db.session.scalars(db.select(Batch)).one().status == 45
+        req = db.session.scalars(select_query()).one()
+        assert req.status == 20
+        assert req.batch_idx is None
+        assert req.claimed_by is None
+        transfers = cfg["WALLET"].list_transfers(req.asset_id)
+        assert transfers[-1].status == rgb_lib.TransferStatus.FAILED
+
+    # the request is then sent by a new batch
+    assert send_batches(get_spare_utxos(cfg)) == [True]
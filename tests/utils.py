@@ -363,6 +363,7 @@ def _get_test_base_app():
     # base configutation
     app.config.from_object(Config)
     app.config["NAME"] = name
+    app.config["NODE_ID"] = name
     app.config["DATA_DIR"] = get_test_datadir()
 
     # network settings
@@ -407,6 +408,7 @@ def _reconfigure_test_app(config):
     app.config["WALLET"] = config["WALLET"]
     app.config["ASSETS"] = config["ASSETS"]
     app.config["ASSET_MIGRATION_MAP"] = config["ASSET_MIGRATION_MAP"]
+    app.config["ROLE"] = config["ROLE"]
 
     return app
 